@@ -1,7 +1,10 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-from data import load_summary_data
-from filters import apply_sidebar_filters
+from data import load_summary_data, load_page_details
+from filters import (apply_sidebar_filters, apply_scoring_profile, render_data_freshness, render_query_filters,
+                     render_scoring_profile)
+from scoring import is_default
 from components import render_key_metrics, render_additional_insights, render_org_row, show_org_detail, render_faq
 
 # ── Auth ──────────────────────────────────────────────────────────────────────
@@ -46,6 +49,37 @@ st.markdown("""
 
 # ── Dashboard layout ──────────────────────────────────────────────────────────
 
+LIST_COLUMNS = [
+    'orgname', 'phone', 'principalofficer', 'city', 'state', 'taxyear',
+    'totalassetseoy', 'totalrevenuecy', 'revenuegrowthyoy', 'programexpenseratio', 'leadscore',
+]
+
+LIST_HEADERS = {
+    'orgname': 'Organization', 'phone': 'phone', 'principalofficer': 'PrincipalOfficer',
+    'city': 'city', 'state': 'state', 'taxyear': 'Year', 'totalassetseoy': 'Assets',
+    'totalrevenuecy': 'Revenue', 'revenuegrowthyoy': 'Rev Growth',
+    'programexpenseratio': 'Program %', 'leadscore': 'Score',
+}
+
+
+def format_numbers(values, template):
+    """values formatted with a %-style template in one vectorized call, "N/A" where missing."""
+    text = pd.Series(np.char.mod(template, values.to_numpy(dtype=float)), index=values.index)
+    return text.where(values.notna(), "N/A")
+
+
+def format_list_page(page):
+    """Display strings for one page of LIST_COLUMNS rows, with LIST_HEADERS names."""
+    page = page.copy()
+    page['phone'] = page['phone'].fillna("N/A")
+    page['totalassetseoy'] = format_numbers(page['totalassetseoy'] / 1_000_000, "$%.1fM")
+    page['totalrevenuecy'] = format_numbers(page['totalrevenuecy'] / 1_000_000, "$%.1fM")
+    page['revenuegrowthyoy'] = format_numbers(page['revenuegrowthyoy'] * 100, "%.1f%%")
+    page['programexpenseratio'] = format_numbers(page['programexpenseratio'] * 100, "%.1f%%")
+    page['leadscore'] = format_numbers(page['leadscore'], "%.1f")
+    return page.rename(columns=LIST_HEADERS)
+
+
 def show_dashboard():
     st.title("IRS 990 FL & NY Search")
     tab1, tab2 = st.tabs(["Dashboard", "FAQ & Help"])
@@ -54,10 +88,18 @@ def show_dashboard():
         render_faq()
 
     with tab1:
-        df = load_summary_data()
+        # Sidebar controls come first so load_summary_data can narrow the snapshot with them
+        weights = render_scoring_profile()
+        selections = render_query_filters()
+        df = load_summary_data(
+            selections['states'], selections['asset_range'],
+            # A re-scored leadscore can only be filtered after scoring
+            selections['min_lead_score'] if is_default(weights) else None,
+        )
+        render_data_freshness()
 
         if df.empty:
-            st.warning("No data available. Please run the data pipeline first.")
+            st.warning("No organizations match the selected filters. If this persists, run the data pipeline first.")
             return
 
         required_cols = ['ein', 'orgname', 'taxyear']
@@ -75,14 +117,12 @@ def show_dashboard():
         if 'iswatchlisted' in df.columns:
             df['iswatchlisted'] = df['iswatchlisted'].fillna(0)
 
-        # One row per org (most recent year)
-        latest_data = (
-            df.sort_values('taxyear', ascending=False)
-            .drop_duplicates(subset=['ein'], keep='first')
-        )
+        # Already one row per org (most recent year)
+        latest_data = df
 
-        # Sidebar filters
-        latest_data = apply_sidebar_filters(latest_data)
+        # What-if lead scoring, then sidebar filters (which include min lead score)
+        latest_data = apply_scoring_profile(latest_data, weights)
+        latest_data = apply_sidebar_filters(latest_data, selections)
 
         # Org name search (main area)
         search_query = st.text_input("Search organizations", "")
@@ -91,50 +131,28 @@ def show_dashboard():
                 latest_data['orgname'].str.contains(search_query, case=False, na=False)
             ]
 
-        latest_data = latest_data.sort_values('taxyear', ascending=False)
-
         # Summary metrics
         render_key_metrics(latest_data)
         render_additional_insights(latest_data)
 
         st.markdown("### Organization List")
 
-        # Build display DataFrame
-        display_cols = [
-            'orgname', 'phone', 'principalofficer', 'city', 'state', 'taxyear',
-            'totalassetseoy', 'totalrevenuecy', 'revenuegrowthyoy', 'programexpenseratio', 'leadscore',
-        ]
-        display_df = latest_data[display_cols].copy()
-        display_df['phone'] = display_df['phone'].apply(lambda x: x if pd.notna(x) else "N/A")
-        display_df['totalassetseoy'] = display_df['totalassetseoy'].apply(
-            lambda x: f"${x/1_000_000:.1f}M" if pd.notna(x) else "N/A")
-        display_df['totalrevenuecy'] = display_df['totalrevenuecy'].apply(
-            lambda x: f"${x/1_000_000:.1f}M" if pd.notna(x) else "N/A")
-        display_df['revenuegrowthyoy'] = display_df['revenuegrowthyoy'].apply(
-            lambda x: f"{x*100:.1f}%" if pd.notna(x) else "N/A")
-        display_df['programexpenseratio'] = display_df['programexpenseratio'].apply(
-            lambda x: f"{x*100:.1f}%" if pd.notna(x) else "N/A")
-        display_df['leadscore'] = display_df['leadscore'].apply(
-            lambda x: f"{x:.1f}" if pd.notna(x) else "N/A")
-        display_df = display_df.rename(columns={
-            'orgname': 'Organization', 'phone': 'phone', 'principalofficer': 'PrincipalOfficer',
-            'city': 'city', 'state': 'state', 'taxyear': 'Year', 'totalassetseoy': 'Assets',
-            'totalrevenuecy': 'Revenue', 'revenuegrowthyoy': 'Rev Growth',
-            'programexpenseratio': 'Program %', 'leadscore': 'Score',
-        })
+        # Only the sort keys are sorted; rows are gathered for the visible page alone
+        order = latest_data[['taxyear', 'leadscore']].sort_values(
+            ['taxyear', 'leadscore'], ascending=False, na_position='last').index
 
         # Pagination
         PAGE_SIZE = 70
-        total_rows = len(display_df)
+        total_rows = len(order)
         total_pages = max(1, (total_rows + PAGE_SIZE - 1) // PAGE_SIZE)
 
         if 'org_page' not in st.session_state:
             st.session_state.org_page = 1
 
-        page = st.session_state.org_page
+        page = min(st.session_state.org_page, total_pages)
         start_idx = (page - 1) * PAGE_SIZE
         end_idx = min(start_idx + PAGE_SIZE, total_rows)
-        paged_df = display_df.iloc[start_idx:end_idx].copy()
+        paged_df = format_list_page(latest_data.loc[order[start_idx:end_idx]].set_index('ein')[LIST_COLUMNS])
         paged_df.insert(0, '#', range(start_idx + 1, end_idx + 1))
 
         st.caption(f"Showing {start_idx + 1}–{end_idx} of {total_rows} organizations")
@@ -151,16 +169,17 @@ def show_dashboard():
                 st.session_state.org_page = total_pages
                 st.rerun()
 
-        # Org rows
-        for i, row in enumerate(paged_df.itertuples()):
-            render_org_row(row, start_idx + i, latest_data)
+        # Org rows, with the page's details fetched in one batch
+        details = load_page_details(paged_df.index)
+        for row in paged_df.itertuples():
+            render_org_row(row, details.loc[row.Index] if row.Index in details.index else None)
 
-        # CSV export
+        # CSV export, built only when the button is clicked, with numbers left unformatted
         _, col_right = st.columns([1, 1])
         with col_right:
             st.download_button(
                 label="Export to CSV",
-                data=display_df.to_csv(index=False),
+                data=lambda: latest_data.loc[order, LIST_COLUMNS].rename(columns=LIST_HEADERS).to_csv(index=False),
                 file_name="prospects.csv",
                 mime="text/csv",
             )
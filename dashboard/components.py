@@ -51,8 +51,8 @@ def render_additional_insights(df):
 
 # ── Organization list row ─────────────────────────────────────────────────────
 
-def render_org_row(row, actual_idx, latest_data):
-    """Render a single organization as an expandable row."""
+def render_org_row(row, details):
+    """Render a single organization as an expandable row; details is its row from load_page_details, or None."""
     org_name = row.Organization
     phone = row.phone if hasattr(row, 'phone') else ''
     year = row.Year if hasattr(row, 'Year') else ''
@@ -65,14 +65,11 @@ def render_org_row(row, actual_idx, latest_data):
         header += f" | 👤 {principal_officer}"
 
     with st.expander(header):
-        ein = latest_data.iloc[actual_idx]['ein']
-        org_df, filings_df, _, _, _ = load_org_details(ein)
-
-        if org_df.empty:
+        if details is None:
             st.warning("Details unavailable.")
             return
 
-        org = org_df.iloc[0]
+        org = details
         city = org.get('city') or 'N/A'
         st.markdown(
             f"**EIN:** {org['ein']} | **City:** {city} | "
@@ -89,17 +86,16 @@ def render_org_row(row, actual_idx, latest_data):
         if org.get('missiondescription'):
             st.markdown("**Mission:** " + org['missiondescription'])
 
-        if not filings_df.empty:
-            latest = filings_df.iloc[0]
+        if pd.notna(org.get('taxyear')):
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("Assets", f"${(latest.get('totalassetseoy') or 0)/1_000_000:.1f}M")
+                st.metric("Assets", f"${(org.get('totalassetseoy') or 0)/1_000_000:.1f}M")
             with col2:
-                st.metric("Revenue", f"${(latest.get('totalrevenuecy') or 0)/1_000_000:.1f}M")
+                st.metric("Revenue", f"${(org.get('totalrevenuecy') or 0)/1_000_000:.1f}M")
             with col3:
-                st.metric("Expenses", f"${(latest.get('totalexpensescy') or 0)/1_000_000:.1f}M")
+                st.metric("Expenses", f"${(org.get('totalexpensescy') or 0)/1_000_000:.1f}M")
             with col4:
-                st.metric("Net Assets", f"${(latest.get('netassetseoy') or 0)/1_000_000:.1f}M")
+                st.metric("Net Assets", f"${(org.get('netassetseoy') or 0)/1_000_000:.1f}M")
 
 
 # ── Org detail page ───────────────────────────────────────────────────────────
@@ -1,6 +1,16 @@
+import itertools
 import streamlit as st
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from postgrest.types import ReturnMethod
 from supabase import create_client
+from snapshots import (TIMESTAMP_FORMAT, read_snapshot, snapshot_metadata, snapshot_version, write_snapshot,
+                       patch_snapshot, write_lock, fetched_at, merge_rows)
+
+# Rows per .range() request, and how many pages of a table are fetched at once
+FETCH_PAGE_SIZE = 1000
+FETCH_WORKERS = 8
 
 
 def normalize_url(url):
@@ -15,71 +25,194 @@ def normalize_url(url):
     return url
 
 
-@st.cache_data(ttl=3600)
-def fetch_table_cached(table_name, columns="*"):
-    try:
-        supabase_url = st.secrets["SUPABASE_URL"]
-        supabase_key = st.secrets["SUPABASE_KEY"]
-        client = create_client(supabase_url, supabase_key)
-
-        all_data = []
-        page = 0
-        page_size = 1000
-
-        while True:
-            response = (
-                client.table(table_name)
-                .select(columns)
-                .range(page * page_size, (page + 1) * page_size - 1)
-                .execute()
-            )
-            if not response.data:
-                break
-            all_data.extend(response.data)
-            if len(response.data) < page_size:
-                break
-            page += 1
-
-        if all_data:
-            df = pd.DataFrame(all_data)
-            df.columns = [c.lower() for c in df.columns]
-            if 'legalname' in df.columns:
-                df = df.rename(columns={'legalname': 'orgname'})
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error fetching {table_name}: {e}")
+def to_frame(records):
+    df = pd.DataFrame(records)
+    if df.columns.empty:
         return pd.DataFrame()
+    df.columns = [c.lower() for c in df.columns]
+    if 'legalname' in df.columns:
+        df = df.rename(columns={'legalname': 'orgname'})
+    return df
 
 
-def fetch_table(table_name, columns="*"):
-    return fetch_table_cached(table_name, columns)
+# org_latest_summary columns read by the list view, its metrics and what-if scoring
+SUMMARY_COLUMNS = [
+    'ein', 'legalname', 'city', 'state', 'nteecode', 'phone', 'principalofficer', 'taxyear',
+    'totalassetseoy', 'totalrevenuecy', 'surplusdeficitcy', 'revenuegrowthyoy', 'programexpenseratio',
+    'adminexpenseratio', 'execcomppercentofrevenue', 'liabilitytoassetratio', 'leadscore',
+    'contactstatus', 'iswatchlisted',
+]
 
 
-def load_summary_data():
-    orgs_all = fetch_table("organizations", "*")
+@st.cache_resource
+def get_client():
+    """One Supabase client per process; its connection pool is shared by every session and fetch thread."""
+    return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
 
-    if orgs_all.empty:
-        return pd.DataFrame()
 
-    orgs = orgs_all[orgs_all['state'].isin(['FL', 'NY'])]
-    if orgs.empty:
-        return pd.DataFrame()
+def fetch_page(client, table_name, columns, filters, order_by, page, count=None):
+    query = client.table(table_name).select(columns, count=count)
+    for method, column, value in filters:
+        query = getattr(query, method)(column, value)
+    if order_by:
+        query = query.order(order_by)
+    return query.range(page * FETCH_PAGE_SIZE, (page + 1) * FETCH_PAGE_SIZE - 1).execute()
+
+
+def page_columns(records):
+    """A page of records as {column: values}."""
+    if not records:
+        return {}
+    return {name: [record[name] for record in records] for name in records[0]}
+
+
+def fetch_rows(table_name, columns="*", filters=(), order_by="ein"):
+    """
+    Every row of table_name matching filters, a tuple of (method, column, value)
+    applied to the query, e.g. ('in_', 'state', ('FL', 'NY')) or ('gte', 'leadscore', 50).
+
+    The first page also returns the exact row count, and the remaining pages
+    are then fetched FETCH_WORKERS at a time. order_by should be unique so
+    the pages do not overlap. With no matching rows the frame still has the
+    requested columns (none for "*").
+    """
+    client = get_client()
+    first = fetch_page(client, table_name, columns, filters, order_by, 0, count="exact")
+    if not first.data:
+        return to_frame({} if columns == "*" else {column.strip(): [] for column in columns.split(",")})
+
+    page_count = -(-first.count // FETCH_PAGE_SIZE)
+    pages = [page_columns(first.data)]
+    if page_count > 1:
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            responses = pool.map(
+                lambda page: fetch_page(client, table_name, columns, filters, order_by, page),
+                range(1, page_count),
+            )
+            pages += [page_columns(response.data) for response in responses]
+
+    data = {name: list(itertools.chain.from_iterable(page.get(name, ()) for page in pages)) for name in pages[0]}
+    return to_frame(data)
+
+
+def count_rows(table_name, filters=()):
+    query = get_client().table(table_name).select("ein", count="exact", head=True)
+    for method, column, value in filters:
+        query = getattr(query, method)(column, value)
+    return query.execute().count
+
+
+# Tables kept as local snapshots: name -> (table, columns, filters). Rows are
+# keyed by ein, and UpdatedAt is stamped by a trigger that export_to_supabase.py installs.
+SNAPSHOTS = {
+    'org_latest_summary': (
+        "org_latest_summary", ", ".join(SUMMARY_COLUMNS + ['updatedat']), (('in_', 'state', ('FL', 'NY')),)),
+    'prospect_activity': (
+        "prospect_activity", "ein, contactstatus, iswatchlisted, updatedat", ()),
+}
+
+# Snapshots older than this are refreshed when loaded
+SNAPSHOT_MAX_AGE = timedelta(hours=1)
+# A transaction still open during the last refresh can commit rows stamped
+# before the watermark, so each refresh re-reads this far back
+SNAPSHOT_LOOKBACK = timedelta(minutes=15)
+
+
+def refresh_snapshot(name, full=False):
+    """Bring a snapshot up to date: the rows written since its watermark, or every row if full or it has none."""
+    table_name, columns, filters = SNAPSHOTS[name]
+    # A save landing mid-refresh waits to patch the frame this writes, instead of being overwritten by it
+    with write_lock:
+        started = datetime.now(timezone.utc)
+        metadata = snapshot_metadata(name)
+        current = None if full or not metadata or not metadata.get('watermark') else read_snapshot(name)
+
+        df = None
+        if current is not None:
+            since = datetime.fromisoformat(metadata['watermark']) - SNAPSHOT_LOOKBACK
+            changed = fetch_rows(table_name, columns, filters + (('gte', 'updatedat', since.strftime(TIMESTAMP_FORMAT)),))
+            df = merge_rows(current.to_pandas(), changed)
+            # Deleted rows, and rows that no longer match filters, never show up as changed
+            if len(df) != count_rows(table_name, filters):
+                df = None
+        if df is None:
+            df = fetch_rows(table_name, columns, filters)
+
+        watermark = df['updatedat'].dropna().max() if 'updatedat' in df.columns else None
+        write_snapshot(name, df, None if pd.isna(watermark) else watermark, started)
+
+
+def refresh_snapshots():
+    """The sidebar's "Refresh now": update every snapshot and drop the cached detail lookups."""
+    for name in SNAPSHOTS:
+        refresh_snapshot(name)
+    fetch_page_details.clear()
+    fetch_org_details.clear()
+
+
+def snapshot_fetched_at():
+    """When the oldest snapshot was fetched, or None if any is missing."""
+    times = [snapshot_metadata(name) for name in SNAPSHOTS]
+    if any(metadata is None for metadata in times):
+        return None
+    return min(fetched_at(metadata) for metadata in times)
+
+
+@st.cache_resource(max_entries=2 * len(SNAPSHOTS))
+def shared_snapshot_frame(name, version):
+    """
+    One DataFrame per snapshot version, shared by every session in the
+    process rather than copied to each caller, so it must not be modified.
+    With split_blocks, numeric columns without nulls stay views of the memory map.
+    """
+    table = read_snapshot(name)
+    return table.to_pandas(split_blocks=True) if table is not None else pd.DataFrame()
+
 
-    filings = fetch_table("filings")
-    metrics = fetch_table("derived_metrics")
-    prospect = fetch_table("prospect_activity")
+def load_snapshot(name):
+    """
+    A snapshot as a shared, read-only DataFrame, refreshed first if it is
+    missing or older than SNAPSHOT_MAX_AGE.
+    """
+    metadata = snapshot_metadata(name)
+    if metadata is None or datetime.now(timezone.utc) - fetched_at(metadata) > SNAPSHOT_MAX_AGE:
+        try:
+            refresh_snapshot(name)
+        except Exception as e:
+            if metadata is None:
+                st.error(f"Error fetching {name}: {e}")
+                return pd.DataFrame()
+            st.warning(f"Could not refresh {name}; showing data fetched {metadata['fetched_at']} UTC. ({e})")
+    return shared_snapshot_frame(name, snapshot_version(name))
 
-    df = orgs.copy()
 
-    if not filings.empty and 'ein' in filings.columns:
-        df = df.merge(filings, on="ein", how="left", suffixes=('', '_fil'))
+def load_summary_data(states=('FL', 'NY'), asset_range=None, min_score=None):
+    """
+    One row per organization (latest filing, its metrics and prospect status)
+    from the org_latest_summary snapshot, filtered to the given state, asset
+    range and minimum lead score.
+    """
+    if not states:
+        return pd.DataFrame()
+
+    df = load_snapshot('org_latest_summary')
+    if df.empty:
+        return pd.DataFrame()
 
-    if not metrics.empty and 'ein' in metrics.columns and 'taxyear' in metrics.columns:
-        df = df.merge(metrics, on=["ein", "taxyear"], how="left", suffixes=('', '_met'))
+    keep = df['state'].isin(states)
+    if asset_range is not None:
+        keep &= df['totalassetseoy'].between(asset_range[0], asset_range[1])
+    if min_score is not None:
+        keep &= df['leadscore'] >= min_score
+    # A boolean mask always copies, so the session gets its own rows, never the shared frame
+    df = df[keep]
 
+    # The summary's status columns are a snapshot from the last export; the
+    # prospect_activity table is edited live from the dashboard
+    prospect = load_snapshot('prospect_activity')
     if not prospect.empty and 'ein' in prospect.columns:
-        df = df.merge(prospect, on="ein", how="left", suffixes=('', '_pros'))
+        df = df.drop(columns=['contactstatus', 'iswatchlisted'], errors='ignore')
+        df = df.merge(prospect[['ein', 'contactstatus', 'iswatchlisted']], on="ein", how="left")
 
     if 'leadscore' in df.columns:
         df = df.sort_values('leadscore', ascending=False, na_position='last')
@@ -87,57 +220,108 @@ def load_summary_data():
     return df
 
 
+# Detail tables and the column they are ordered by (latest first)
+ORG_DETAIL_TABLES = [
+    ('organizations', None),
+    ('filings', 'taxyear'),
+    ('derived_metrics', 'taxyear'),
+    ('executive_compensation', 'taxyear'),
+    ('prospect_activity', None),
+]
+
+
+@st.cache_data(ttl=3600, max_entries=500)
+def fetch_org_details(ein):
+    """One organization's rows from each detail table, looked up by EIN; least recently used EINs are evicted first."""
+    client = get_client()
+
+    frames = []
+    for table_name, order_by in ORG_DETAIL_TABLES:
+        df = to_frame(client.table(table_name).select("*").eq("ein", ein).execute().data)
+        if order_by and not df.empty:
+            df = df.sort_values(order_by, ascending=False)
+        frames.append(df)
+    return tuple(frames)
+
+
 def load_org_details(ein):
-    org_df = fetch_table("organizations", "*")
-    org_df = org_df[org_df['ein'] == ein]
+    """(org, filings, metrics, exec comp, prospect) frames for one EIN."""
+    try:
+        return fetch_org_details(ein)
+    except Exception as e:
+        st.error(f"Error fetching details for {ein}: {e}")
+        return tuple(pd.DataFrame() for _ in ORG_DETAIL_TABLES)
 
-    filings_df = fetch_table("filings", "*")
-    if not filings_df.empty and 'ein' in filings_df.columns:
-        filings_df = filings_df[filings_df['ein'] == ein].sort_values('taxyear', ascending=False)
-    else:
-        filings_df = pd.DataFrame()
 
-    metrics_df = fetch_table("derived_metrics", "*")
-    if not metrics_df.empty and 'ein' in metrics_df.columns:
-        metrics_df = metrics_df[metrics_df['ein'] == ein].sort_values('taxyear', ascending=False)
-    else:
-        metrics_df = pd.DataFrame()
+# What a list row shows: organizations columns, plus its latest filing's
+# figures from org_latest_summary
+ROW_DETAIL_COLUMNS = ['ein', 'city', 'state', 'nteecode', 'websiteurl', 'phone', 'principalofficer', 'missiondescription']
+ROW_FILING_COLUMNS = ['ein', 'taxyear', 'totalassetseoy', 'totalrevenuecy', 'totalexpensescy', 'netassetseoy']
 
-    exec_df = fetch_table("executive_compensation", "*")
-    if not exec_df.empty and 'ein' in exec_df.columns:
-        exec_df = exec_df[exec_df['ein'] == ein].sort_values('taxyear', ascending=False)
-    else:
-        exec_df = pd.DataFrame()
 
-    prospect_df = fetch_table("prospect_activity", "*")
-    if not prospect_df.empty and 'ein' in prospect_df.columns:
-        prospect_df = prospect_df[prospect_df['ein'] == ein]
-    else:
-        prospect_df = pd.DataFrame()
+@st.cache_data(ttl=3600, max_entries=200)
+def fetch_page_details(eins):
+    """Details for a page of list rows, indexed by EIN: one query for the organizations and one for their latest filings."""
+    client = get_client()
 
-    return org_df, filings_df, metrics_df, exec_df, prospect_df
+    orgs = to_frame(client.table("organizations").select(", ".join(ROW_DETAIL_COLUMNS)).in_("ein", list(eins)).execute().data)
+    if orgs.empty:
+        return pd.DataFrame()
+    latest = to_frame(client.table("org_latest_summary").select(", ".join(ROW_FILING_COLUMNS)).in_("ein", list(eins)).execute().data)
+    if not latest.empty:
+        orgs = orgs.merge(latest, on='ein', how='left')
+    return orgs.set_index('ein', drop=False)
+
+
+def load_page_details(eins):
+    try:
+        return fetch_page_details(tuple(eins))
+    except Exception as e:
+        st.error(f"Error fetching organization details: {e}")
+        return pd.DataFrame()
 
 
 def save_prospect_activity(ein, contact_status, is_watchlisted, notes):
+    """
+    Upsert one organization's prospect record, then write it through to the
+    local prospect_activity snapshot so the list view shows it on the next
+    rerun without a refetch.
+    """
+    record = {
+        "ein": ein,
+        "contactstatus": contact_status,
+        "iswatchlisted": 1 if is_watchlisted else 0,
+        "privatenotes": notes,
+    }
     try:
-        supabase_url = st.secrets["SUPABASE_URL"]
-        supabase_key = st.secrets["SUPABASE_KEY"]
-        conn = create_client(supabase_url, supabase_key)
-
-        existing = conn.table("prospect_activity").select("*").eq("ein", ein).execute()
-
-        if existing.data:
-            conn.table("prospect_activity").update({
-                "contactstatus": contact_status,
-                "iswatchlisted": 1 if is_watchlisted else 0,
-                "privatenotes": notes,
-            }).eq("ein", ein).execute()
-        else:
-            conn.table("prospect_activity").insert({
-                "ein": ein,
-                "contactstatus": contact_status,
-                "iswatchlisted": 1 if is_watchlisted else 0,
-                "privatenotes": notes,
-            }).execute()
+        get_client().table("prospect_activity").upsert(
+            record, on_conflict="ein", returning=ReturnMethod.minimal).execute()
+        patch_snapshot('prospect_activity', pd.DataFrame([record]))
+        fetch_org_details.clear(ein)
     except Exception as e:
         st.error(f"Error saving: {e}")
+
+
+@st.cache_data(ttl=3600)
+def load_scoring_profiles():
+    """Saved lead-score weight profiles as {name: weights}."""
+    try:
+        client = get_client()
+
+        response = client.table("scoring_profiles").select("name, weights").order("name").execute()
+        return {row['name']: row['weights'] for row in response.data}
+    except Exception as e:
+        st.error(f"Error fetching scoring profiles: {e}")
+        return {}
+
+
+def save_scoring_profile(name, weights):
+    try:
+        get_client().table("scoring_profiles").upsert({
+            "name": name,
+            "weights": weights,
+            "updatedat": datetime.now(timezone.utc).isoformat(),
+        }).execute()
+        load_scoring_profiles.clear()
+    except Exception as e:
+        st.error(f"Error saving scoring profile: {e}")
@@ -1,57 +1,93 @@
 import streamlit as st
 import pandas as pd
+from datetime import datetime, timezone
+from data import (SNAPSHOT_MAX_AGE, load_scoring_profiles, save_scoring_profile, snapshot_fetched_at,
+                  refresh_snapshots)
+from scoring import DEFAULT_PROFILE, DEFAULT_WEIGHTS, WEIGHT_LABELS, score_frame, is_default
 
 
-def apply_sidebar_filters(df):
-    """Render sidebar filters and return filtered DataFrame."""
+STATUS_OPTIONS = [
+    'not_contacted', 'called_no_answer', 'called_not_interested',
+    'called_interested', 'meeting_scheduled', 'client',
+]
+
+
+def render_query_filters():
+    """
+    Render the sidebar filters chosen before any data is loaded and return
+    them. load_summary_data applies state, asset range and min lead score to
+    the local snapshot; the rest wait for apply_sidebar_filters.
+    """
     st.sidebar.header("Filters")
     st.sidebar.markdown("**Filter by:**")
 
     # Contact status
-    status_options = [
-        'not_contacted', 'called_no_answer', 'called_not_interested',
-        'called_interested', 'meeting_scheduled', 'client',
-    ]
-    if 'contactstatus' in df.columns:
-        selected_statuses = st.sidebar.multiselect(
-            "Contact Status", status_options, default=['not_contacted'],
-            help="Filter organizations by your contact status tracking",
-        )
-        df = df[df['contactstatus'].isin(selected_statuses)]
+    selected_statuses = st.sidebar.multiselect(
+        "Contact Status", STATUS_OPTIONS, default=['not_contacted'],
+        help="Filter organizations by your contact status tracking",
+    )
 
     # State
     selected_states = st.sidebar.multiselect(
         "State (FL/NY)", ['FL', 'NY'], default=['FL', 'NY'],
         help="Filter by state - Florida or New York",
     )
-    df = df[df['state'].isin(selected_states)]
 
     # Lead score
-    min_score = int(df['leadscore'].min()) if not df['leadscore'].isna().all() else 0
     min_lead_score = st.sidebar.slider(
-        "Min Lead Score", 0, 100, min_score,
+        "Min Lead Score", 0, 100, 0,
         help="Minimum composite score (0-100). Higher scores indicate better prospects.",
     )
-    df = df[df['leadscore'] >= min_lead_score]
 
     # Asset range
-    if 'totalassetseoy' in df.columns:
-        min_assets = 1_000_000
-        max_assets = 50_000_000
-        default_max = 10_000_000
-        st.sidebar.markdown(
-            f'<div style="color:#00C853;font-weight:bold;margin-bottom:-10px;">'
-            f'Asset Range: ${min_assets:,.0f} – ${default_max:,.0f}</div>',
-            unsafe_allow_html=True,
-        )
-        asset_range = st.sidebar.slider(
-            "", min_assets, max_assets, (min_assets, default_max),
-            help="Filter by total assets at fiscal year end",
-        )
-        df = df[
-            (df['totalassetseoy'] >= asset_range[0]) &
-            (df['totalassetseoy'] <= asset_range[1])
-        ]
+    min_assets = 1_000_000
+    max_assets = 50_000_000
+    default_max = 10_000_000
+    st.sidebar.markdown(
+        f'<div style="color:#00C853;font-weight:bold;margin-bottom:-10px;">'
+        f'Asset Range: ${min_assets:,.0f} – ${default_max:,.0f}</div>',
+        unsafe_allow_html=True,
+    )
+    asset_range = st.sidebar.slider(
+        "", min_assets, max_assets, (min_assets, default_max),
+        help="Filter by total assets at fiscal year end",
+    )
+
+    return {
+        'statuses': selected_statuses,
+        'states': selected_states,
+        'min_lead_score': min_lead_score,
+        'asset_range': asset_range,
+    }
+
+
+def render_data_freshness():
+    """Sidebar note on how old the local data snapshot is, with a button to refresh it now."""
+    fetched = snapshot_fetched_at()
+    if fetched is not None:
+        age = datetime.now(timezone.utc) - fetched
+        note = f"Data as of {fetched:%Y-%m-%d %H:%M} UTC ({age.total_seconds() // 60:.0f} min ago)"
+        if age > SNAPSHOT_MAX_AGE:
+            note += " - refresh failed, showing older data"
+        st.sidebar.caption(note)
+
+    if st.sidebar.button("Refresh now", help="Fetch the rows changed in Supabase since the last refresh"):
+        with st.spinner("Refreshing data..."):
+            try:
+                refresh_snapshots()
+            except Exception as e:
+                st.sidebar.error(f"Refresh failed: {e}")
+                return
+        st.rerun()
+
+
+def apply_sidebar_filters(df, selections):
+    """Apply the selections load_summary_data did not, render the remaining filters and return filtered DataFrame."""
+    if 'contactstatus' in df.columns:
+        df = df[df['contactstatus'].isin(selections['statuses'])]
+
+    # load_summary_data already applied this unless the lead score was re-scored
+    df = df[df['leadscore'] >= selections['min_lead_score']]
 
     # Tax year
     tax_years = sorted(df['taxyear'].dropna().unique().tolist())
@@ -91,3 +127,38 @@ def apply_sidebar_filters(df):
         st.sidebar.metric("Avg Program Ratio", f"{df['programexpenseratio'].mean()*100:.1f}%")
 
     return df
+
+
+def render_scoring_profile():
+    """Render lead-score weight controls and return the chosen weights."""
+    profiles = {DEFAULT_PROFILE: DEFAULT_WEIGHTS, **load_scoring_profiles()}
+
+    with st.sidebar.expander("Lead Score Weights"):
+        profile = st.selectbox(
+            "Scoring Profile", list(profiles),
+            help="Saved weight profiles. Adjust the sliders to try a what-if scoring model.",
+        )
+        base = {**DEFAULT_WEIGHTS, **profiles[profile]}
+        weights = {
+            key: st.slider(label, 0, 100, int(base[key]), key=f"weight_{profile}_{key}")
+            for key, label in WEIGHT_LABELS.items()
+        }
+
+        new_name = st.text_input("Save as profile", value="" if profile == DEFAULT_PROFILE else profile)
+        if st.button("Save Profile"):
+            if not new_name or new_name == DEFAULT_PROFILE:
+                st.warning("Enter a name other than the default profile.")
+            else:
+                save_scoring_profile(new_name, weights)
+                st.success(f"Saved profile '{new_name}'")
+
+    return weights
+
+
+def apply_scoring_profile(df, weights):
+    """Re-score df with weights."""
+    # The stored leadscore already uses the default weights
+    if not is_default(weights):
+        df = df.copy()
+        df['leadscore'] = score_frame(df, weights)
+    return df
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+
+# Same defaults as LEAD_SCORE_WEIGHTS in pipeline/parse_and_load.py, so the
+# default profile reproduces the stored leadscore column.
+DEFAULT_WEIGHTS = {
+    'revenue_growth': 25,
+    'program_ratio': 30,
+    'surplus': 20,
+    'liability_ratio': 15,
+    'exec_comp': 10,
+}
+DEFAULT_PROFILE = 'Default'
+
+WEIGHT_LABELS = {
+    'revenue_growth': 'Revenue Growth',
+    'program_ratio': 'Program Expense Ratio',
+    'surplus': 'Operating Surplus',
+    'liability_ratio': 'Liability Ratio (penalty)',
+    'exec_comp': 'Exec Compensation (penalty)',
+}
+
+
+def _column(df, name):
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+
+def score_frame(df, weights):
+    """
+    Lead score (0-100) for every row of df under `weights`, computed from the
+    stored derived_metrics / filings columns with the pipeline's formula.
+    Rows with none of the weighted inputs get NaN.
+    """
+    revenue_growth = _column(df, 'revenuegrowthyoy')
+    program_ratio = _column(df, 'programexpenseratio')
+    surplus_deficit = _column(df, 'surplusdeficitcy')
+    liability_ratio = _column(df, 'liabilitytoassetratio')
+    exec_comp_pct = _column(df, 'execcomppercentofrevenue')
+
+    score = np.zeros(len(df))
+    weight_sum = np.zeros(len(df))
+
+    # Terms are added in the same order as the pipeline's compute_lead_scores
+    for values, key, sign in (
+        (revenue_growth, 'revenue_growth', 1),
+        (program_ratio, 'program_ratio', 1),
+        (None, 'surplus', 1),
+        (liability_ratio, 'liability_ratio', -1),
+        (exec_comp_pct, 'exec_comp', -1),
+    ):
+        weight = weights.get(key, 0)
+        if values is None:
+            score += np.where(surplus_deficit > 0, float(weight), 0.0)
+            weight_sum += ~np.isnan(surplus_deficit) * weight
+            continue
+        present = ~np.isnan(values)
+        score += sign * np.where(present, values * weight, 0.0)
+        weight_sum += present * weight
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = score / weight_sum * 100
+    scores = np.where(weight_sum != 0, np.clip(normalized, 0, 100), np.nan)
+    return pd.Series(scores, index=df.index)
+
+
+def is_default(weights):
+    return all(weights.get(key) == value for key, value in DEFAULT_WEIGHTS.items())
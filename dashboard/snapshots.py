@@ -0,0 +1,99 @@
+"""
+Local Arrow snapshots of Supabase tables.
+
+Each snapshot is an uncompressed Arrow IPC file, so loading it is a memory
+map rather than a download. The schema metadata records when it was fetched
+and its watermark, the newest UpdatedAt it holds. data.py uses that to fetch
+only the rows written since.
+"""
+
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+SNAPSHOT_DIR = os.environ.get(
+    "DASHBOARD_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshots"))
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Held across every read-merge-write of a snapshot file (refreshes and
+# patches), so concurrent sessions never write back a frame missing another's rows
+write_lock = threading.Lock()
+
+
+def snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, f"{name}.arrow")
+
+
+def snapshot_version(name):
+    """Changes whenever the snapshot file is rewritten; None if there is none yet."""
+    try:
+        return os.stat(snapshot_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_snapshot(name):
+    """The snapshot as a memory-mapped pa.Table, or None if there is no readable snapshot."""
+    try:
+        with pa.memory_map(snapshot_path(name)) as source:
+            return pa.ipc.open_file(source).read_all()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+
+def snapshot_metadata(name):
+    """The snapshot's metadata dict (watermark, fetched_at) without reading its rows, or None."""
+    try:
+        with pa.memory_map(snapshot_path(name)) as source:
+            schema = pa.ipc.open_file(source).schema
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    return {k.decode(): v.decode() for k, v in (schema.metadata or {}).items()}
+
+
+def write_snapshot(name, df, watermark, fetched_at):
+    """Replace the snapshot atomically, so readers see either the old file or the new one."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        'watermark': watermark or '',
+        'fetched_at': fetched_at.strftime(TIMESTAMP_FORMAT),
+    })
+    path = snapshot_path(name)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def fetched_at(metadata):
+    return datetime.strptime(metadata['fetched_at'], TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def merge_rows(current, changed, key='ein'):
+    """current with every row whose key appears in changed replaced by changed's row."""
+    if changed.empty:
+        return current
+    return pd.concat([current[~current[key].isin(changed[key])], changed], ignore_index=True)
+
+
+def patch_snapshot(name, rows, key='ein'):
+    """
+    Write rows (a DataFrame) through to an existing snapshot, replacing the
+    rows with the same key. The watermark and fetched_at are kept, so the
+    next refresh still fetches everything written since the last one. A
+    missing snapshot is left alone: the next load fetches it in full.
+    """
+    with write_lock:
+        table = read_snapshot(name)
+        metadata = snapshot_metadata(name)
+        if table is None or metadata is None:
+            return
+        df = merge_rows(table.to_pandas(), rows.reindex(columns=table.column_names), key)
+        write_snapshot(name, df, metadata.get('watermark'), fetched_at(metadata))
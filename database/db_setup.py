@@ -1,5 +1,6 @@
 import sqlite3
 import os
+from contextlib import contextmanager
 
 DB_PATH = "database/nonprofit_intelligence.db"
 SCHEMA_PATH = "database/schema.sql"
@@ -8,18 +9,145 @@ def get_connection():
     os.makedirs("database", exist_ok=True)
     return sqlite3.connect(DB_PATH)
 
-def setup_database():
-    conn = get_connection()
-    cursor = conn.cursor()
+# Settings applied for the duration of a bulk load. Durability is traded for
+# speed: with synchronous=OFF a power loss mid-load can corrupt the database,
+# which is acceptable because a load can always be rerun from the raw XML.
+BULK_LOAD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'cache_size': -262144,  # negative = KiB, so 256 MB
+    'temp_store': 'MEMORY',
+}
+
+@contextmanager
+def bulk_load_profile(conn):
+    """Apply BULK_LOAD_PRAGMAS to conn and restore the previous settings afterwards."""
+    conn.commit()
+    previous = {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in BULK_LOAD_PRAGMAS}
+    for name, value in BULK_LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    try:
+        yield conn
+    finally:
+        conn.commit()
+        for name, value in previous.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+
+ORG_LATEST_SUMMARY_COLUMNS = [
+    'EIN', 'LegalName', 'City', 'State', 'NTEECode', 'Phone', 'PrincipalOfficer', 'WebsiteUrl',
+    'TaxYear', 'TotalAssetsEOY', 'TotalRevenueCY', 'TotalExpensesCY', 'NetAssetsEOY', 'SurplusDeficitCY',
+    'RevenueGrowthYoY', 'ProgramExpenseRatio', 'AdminExpenseRatio', 'FundraisingExpenseRatio',
+    'ExecCompPercentOfRevenue', 'LiabilityToAssetRatio', 'ContributionDependencyPct', 'SurplusTrend',
+    'LeadScore', 'ContactStatus', 'IsWatchlisted',
+]
+
+# One row per organization: its most recent filing, that year's metrics and its prospect status
+ORG_LATEST_SUMMARY_INSERT = f"""
+    INSERT INTO org_latest_summary ({', '.join(ORG_LATEST_SUMMARY_COLUMNS)})
+    SELECT o.EIN, o.LegalName, o.City, o.State, o.NTEECode, o.Phone, o.PrincipalOfficer, o.WebsiteUrl,
+           f.TaxYear, f.TotalAssetsEOY, f.TotalRevenueCY, f.TotalExpensesCY, f.NetAssetsEOY, f.SurplusDeficitCY,
+           m.RevenueGrowthYoY, m.ProgramExpenseRatio, m.AdminExpenseRatio, m.FundraisingExpenseRatio,
+           m.ExecCompPercentOfRevenue, m.LiabilityToAssetRatio, m.ContributionDependencyPct, m.SurplusTrend,
+           m.LeadScore, COALESCE(p.ContactStatus, 'not_contacted'), COALESCE(p.IsWatchlisted, 0)
+    FROM organizations o
+    LEFT JOIN filings f
+        ON f.EIN = o.EIN AND f.TaxYear = (SELECT MAX(TaxYear) FROM filings WHERE EIN = o.EIN)
+    LEFT JOIN derived_metrics m ON m.EIN = f.EIN AND m.TaxYear = f.TaxYear
+    LEFT JOIN prospect_activity p ON p.EIN = o.EIN
+"""
+
+# (version, script) applied in order on top of the schema.sql baseline (version 1);
+# PRAGMA user_version records the last one a database has received.
+MIGRATIONS = [
+    (2, f"""
+        CREATE TABLE IF NOT EXISTS org_latest_summary (
+            EIN TEXT PRIMARY KEY,
+            LegalName TEXT,
+            City TEXT,
+            State TEXT,
+            NTEECode TEXT,
+            Phone TEXT,
+            PrincipalOfficer TEXT,
+            WebsiteUrl TEXT,
+            TaxYear INTEGER,
+            TotalAssetsEOY INTEGER,
+            TotalRevenueCY INTEGER,
+            TotalExpensesCY INTEGER,
+            NetAssetsEOY INTEGER,
+            SurplusDeficitCY INTEGER,
+            RevenueGrowthYoY REAL,
+            ProgramExpenseRatio REAL,
+            AdminExpenseRatio REAL,
+            FundraisingExpenseRatio REAL,
+            ExecCompPercentOfRevenue REAL,
+            LiabilityToAssetRatio REAL,
+            ContributionDependencyPct REAL,
+            SurplusTrend REAL,
+            LeadScore REAL,
+            ContactStatus TEXT,
+            IsWatchlisted INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_org_latest_summary_state_score ON org_latest_summary(State, LeadScore);
+        -- Redundant with the UNIQUE (EIN, ...) indexes, and each one slows every insert
+        DROP INDEX IF EXISTS idx_filings_ein;
+        DROP INDEX IF EXISTS idx_executive_compensation_ein;
+        DROP INDEX IF EXISTS idx_derived_metrics_ein;
+        DELETE FROM org_latest_summary;
+        {ORG_LATEST_SUMMARY_INSERT};
+    """),
+    (3, """
+        -- Raw XML sources already loaded, so reruns only parse new or changed files
+        CREATE TABLE IF NOT EXISTS parse_ledger (
+            SourcePath TEXT PRIMARY KEY,
+            Size INTEGER,
+            MTime REAL,
+            ContentHash TEXT,
+            EIN TEXT,
+            TaxYear INTEGER,
+            ParsedAt TEXT DEFAULT (datetime('now'))
+        );
+    """),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def apply_schema(conn):
+    """Create the baseline tables if needed and run pending migrations; safe to run against an existing database."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0:
+        # Databases created before migrations existed hold the baseline tables
+        # already; IF NOT EXISTS lets them through unchanged.
+        with open(SCHEMA_PATH, 'r') as f:
+            schema = f.read()
+        
+        conn.executescript(f"BEGIN;\n{schema}\nPRAGMA user_version = 1;\nCOMMIT;")
+        version = 1
     
-    with open(SCHEMA_PATH, 'r') as f:
-        schema = f.read()
+    for target, script in MIGRATIONS:
+        if version < target:
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {target};\nCOMMIT;")
+            print(f"Migrated database schema to version {target}")
+            version = target
+
+def refresh_org_latest_summary(conn, eins=None):
+    """Rebuild org_latest_summary, or only the rows for `eins`."""
+    if eins is None:
+        conn.execute("DELETE FROM org_latest_summary")
+        conn.execute(ORG_LATEST_SUMMARY_INSERT)
+        return
     
-    cursor.executescript(schema)
-    conn.commit()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS summary_eins (EIN TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.summary_eins")
+    conn.executemany("INSERT OR IGNORE INTO temp.summary_eins (EIN) VALUES (?)", [(ein,) for ein in eins])
+    conn.execute("DELETE FROM org_latest_summary WHERE EIN IN (SELECT EIN FROM temp.summary_eins)")
+    conn.execute(ORG_LATEST_SUMMARY_INSERT + " WHERE o.EIN IN (SELECT EIN FROM temp.summary_eins)")
+
+def setup_database():
+    conn = get_connection()
+    apply_schema(conn)
     conn.close()
     
-    print(f"Database setup complete: {DB_PATH}")
+    print(f"Database setup complete: {DB_PATH} (schema version {SCHEMA_VERSION})")
 
 def get_db_path():
     return DB_PATH
@@ -1,3 +1,6 @@
+-- Baseline schema (version 1). Do not edit: every later change is a numbered
+-- migration in db_setup.py MIGRATIONS, tracked with PRAGMA user_version.
+
 -- Organizations table
 CREATE TABLE IF NOT EXISTS organizations (
     EIN TEXT PRIMARY KEY,
@@ -0,0 +1,123 @@
+"""
+Persistent record of which TEOS archives have been processed.
+
+For every archive URL the ledger keeps the ETag / Last-Modified / Content-Length
+the server reported, the fingerprint of the target OBJECT_ID set it was scanned
+for, where the matching members live inside the archive, and which of them have
+already been written out. A rerun uses this to skip unchanged archives and to
+resume partially processed ones without re-reading their central directory.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+LEDGER_PATH = 'data/download_ledger.json'
+
+# Flush the ledger to disk after this many newly yielded members.
+FLUSH_EVERY = 100
+
+
+def targets_fingerprint(object_ids):
+    digest = hashlib.sha1()
+    for object_id in sorted(object_ids):
+        digest.update(object_id.encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def validators_from_headers(headers):
+    return {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'content_length': headers.get('Content-Length'),
+    }
+
+
+class DownloadLedger:
+    """
+    before_flush, if given, runs before every save. Pass the store's commit so
+    that no member is ever recorded as yielded ahead of the data written for it.
+    """
+
+    def __init__(self, path=LEDGER_PATH, fingerprint=None, before_flush=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.before_flush = before_flush
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def entry(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            return dict(entry) if entry else None
+
+    def _matches(self, entry, validators):
+        if not entry or entry.get('targets') != self.fingerprint:
+            return False
+        if validators.get('etag'):
+            return entry.get('etag') == validators['etag']
+        if validators.get('last_modified'):
+            return (entry.get('last_modified') == validators['last_modified']
+                    and entry.get('content_length') == validators.get('content_length'))
+        return False
+
+    def is_unchanged(self, url, validators):
+        """True if the archive matches what we recorded and was scanned for the same targets."""
+        with self.lock:
+            return self._matches(self.entries.get(url), validators)
+
+    def conditional_headers(self, url):
+        """If-None-Match / If-Modified-Since headers for an archive that needs no further work."""
+        with self.lock:
+            entry = self.entries.get(url)
+            if not entry or not entry.get('complete') or entry.get('targets') != self.fingerprint:
+                return {}
+            headers = {}
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            return headers
+
+    def start(self, url, validators, members=None):
+        """Begin (or restart) an archive; `members` are the matching ZipMember tuples, if known."""
+        with self.lock:
+            previous = self.entries.get(url)
+            resumed = self._matches(previous, validators)
+            self.entries[url] = {
+                **validators,
+                'targets': self.fingerprint,
+                'members': [list(m) for m in members] if members is not None else (
+                    previous.get('members') if resumed else None),
+                'yielded': previous.get('yielded', []) if resumed else [],
+                'complete': False,
+            }
+            self._flush()
+
+    def record_yielded(self, url, object_id):
+        with self.lock:
+            self.entries[url]['yielded'].append(object_id)
+            self.pending += 1
+            if self.pending >= FLUSH_EVERY:
+                self._flush()
+
+    def finish(self, url):
+        with self.lock:
+            self.entries[url]['complete'] = True
+            self._flush()
+
+    def _flush(self):
+        if self.before_flush:
+            self.before_flush()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.pending = 0
@@ -1,14 +1,30 @@
 import pandas as pd
 import requests
 import zipfile
-import io
 import os
+import sys
+import time
+import resource
+import tempfile
+import threading
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from remote_zip import (ByteBudget, NotModified, RangeNotSupported, ZipMember,
+                        read_central_directory, iter_remote_members)
+from xml_store import XMLPackWriter
+from download_ledger import DownloadLedger, targets_fingerprint, validators_from_headers
 
 INPUT_FILE = 'data/matched_filing_index.csv'
 OUTPUT_DIR = 'data/raw_xml'
 FAILED_LOG = 'data/failed_downloads.log'
 
+# Archives are spooled in memory up to this size, then to a temp file on disk.
+SPOOL_MAX_MEMORY_MB = 64
+CHUNK_SIZE = 1024 * 1024
+# Cap on archive bytes held in memory across all --workers at once.
+MAX_IN_FLIGHT_MB = 256
+
 ZIP_SUFFIXES = ['01A', '02A', '03A', '04A', '05A', '06A', '07A',
                 '08A', '09A', '10A', '11A', '11B', '11C', '12A']
 
@@ -25,92 +41,414 @@ def load_matched_filings():
     df = pd.read_csv(INPUT_FILE, dtype=str)
     return df
 
-def download_from_zips(object_id_to_ein, filings_df):
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    
-    zip_urls = build_zip_urls()
-    
-    ein_to_taxperiod = {}
-    for _, row in filings_df.iterrows():
-        ein = str(row['EIN'])
-        tp = str(row['TAX_PERIOD'])
-        if ein not in ein_to_taxperiod:
-            ein_to_taxperiod[ein] = tp
-    
-    extracted = 0
-    already_exists = 0
-    
-    for year, zip_url in zip_urls:
+def member_object_id(filename):
+    if not filename.endswith('_public.xml'):
+        return None
+    return filename.replace('_public.xml', '').split('/')[-1]
+
+def peak_rss_mb():
+    """Highest RSS the whole process has reached so far; ru_maxrss never resets, so this is not per archive."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+def spool_archive(response, max_memory_mb):
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory_mb * 1024 * 1024, dir=os.path.dirname(OUTPUT_DIR))
+    size = 0
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return spool, size
+
+def extract_full_archive(response, zip_url, validators, object_id_to_ein, state, counts,
+                         max_memory_mb=SPOOL_MAX_MEMORY_MB):
+    spool, size = spool_archive(response, max_memory_mb)
+    counts['bytes_fetched'] += size
+    state.ledger.start(zip_url, validators or validators_from_headers(response.headers))
+
+    with spool, zipfile.ZipFile(spool) as zf:
+        for filename in zf.namelist():
+            object_id = member_object_id(filename)
+            if object_id not in object_id_to_ein:
+                continue
+
+            if not state.claim(object_id):
+                counts['already_exists'] += 1
+            else:
+                save_member(zip_url, object_id, zf.read(filename), state, counts)
+    state.finish_archive(zip_url)
+
+def extract_ranged_archive(session, zip_url, validators, object_id_to_ein, state, counts):
+    stats = {}
+    name = zip_url.split('/')[-1]
+    try:
+        entry = state.ledger.entry(zip_url)
+        if validators and entry and entry.get('members') is not None and state.ledger.is_unchanged(zip_url, validators):
+            # Interrupted last time: we already know where the matching members are
+            yielded = set(entry['yielded'])
+            members = [ZipMember(*m) for m in entry['members']]
+            counts['already_exists'] += sum(1 for m in members if member_object_id(m.filename) in yielded)
+            members = [m for m in members if member_object_id(m.filename) not in yielded]
+            state.ledger.start(zip_url, validators)
+            print(f"  {name}: resuming, {len(yielded)} members already yielded, {len(members)} to go")
+        else:
+            all_members, archive_size = read_central_directory(
+                session, zip_url, stats, headers=state.ledger.conditional_headers(zip_url))
+            members = [m for m in all_members if member_object_id(m.filename) in object_id_to_ein]
+            if not validators:
+                validators = validators_from_headers(stats.get('headers', {}))
+                validators['content_length'] = str(archive_size)
+            state.ledger.start(zip_url, validators, members)
+            print(f"  {name}: {len(members)} of {len(all_members)} members match ({archive_size / 1e6:.0f} MB archive)")
+
+        wanted = []
+        for member in members:
+            if not state.claim(member_object_id(member.filename)):
+                counts['already_exists'] += 1
+            else:
+                wanted.append(member)
+
+        try:
+            for member, xml_content in iter_remote_members(session, zip_url, wanted, stats, budget=state.budget):
+                object_id = member_object_id(member.filename)
+                save_member(zip_url, object_id, xml_content, state, counts)
+        except Exception:
+            # Hand unfinished members back so a full-download fallback can claim them
+            for member in wanted:
+                state.unclaim(member_object_id(member.filename))
+            raise
+        state.finish_archive(zip_url)
+    finally:
+        counts['bytes_fetched'] += stats.get('bytes_fetched', 0)
+        counts['range_requests'] += stats.get('requests', 0)
+
+def save_member(zip_url, object_id, xml_content, state, counts):
+    raw_xml_path = state.store.save(object_id, xml_content) if state.save_xml else None
+    if state.loader:
+        # With --fuse a filing only counts as yielded once the loader has committed it
+        state.loader.submit(object_id, xml_content, raw_xml_path=raw_xml_path,
+                            on_committed=state.defer_yield(zip_url, object_id))
+    else:
+        state.ledger.record_yielded(zip_url, object_id)
+    counts['extracted'] += 1
+    extracted = state.record_extracted()
+    if extracted % 25 == 0:
+        print(f"  Extracted {extracted} files so far...")
+
+class FileStore:
+    """One uncompressed {ein}_{tax_period}.xml file per filing in OUTPUT_DIR."""
+
+    def __init__(self, object_id_to_ein, ein_to_taxperiod):
+        self.object_id_to_ein = object_id_to_ein
+        self.ein_to_taxperiod = ein_to_taxperiod
+
+    def key(self, object_id):
+        ein = self.object_id_to_ein[object_id]
+        tax_period = self.ein_to_taxperiod.get(ein, 'unknown')
+        return os.path.join(OUTPUT_DIR, f"{ein}_{tax_period}.xml")
+
+    def exists(self, key):
+        return os.path.exists(key)
+
+    def save(self, object_id, xml_content):
+        save_path = self.key(object_id)
+        # Write under a temporary name so a crash never leaves a truncated file behind
+        tmp_path = save_path + '.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(xml_content)
+        os.replace(tmp_path, save_path)
+        return save_path
+
+    def commit(self):
+        # Each file is in place as soon as save() returns
+        pass
+
+    def close(self):
+        pass
+
+class PackStore:
+    """Compressed pack files keyed by OBJECT_ID (see xml_store.py)."""
+
+    def __init__(self, object_id_to_ein, object_id_to_period):
+        self.object_id_to_ein = object_id_to_ein
+        self.object_id_to_period = object_id_to_period
+        self.writer = XMLPackWriter()
+
+    def key(self, object_id):
+        return object_id
+
+    def exists(self, key):
+        return self.writer.contains(key)
+
+    def save(self, object_id, xml_content):
+        return self.writer.put(object_id, self.object_id_to_ein[object_id],
+                               self.object_id_to_period.get(object_id), xml_content)
+
+    def commit(self):
+        self.writer.commit()
+
+    def close(self):
+        self.writer.close()
+
+class DownloadState:
+    """Counters, claimed filings and the in-flight byte budget shared by archive workers."""
+
+    def __init__(self, max_in_flight_mb, ledger, store, loader=None, save_xml=True):
+        self.lock = threading.Lock()
+        self.ledger = ledger
+        self.store = store
+        self.loader = loader
+        self.save_xml = save_xml
+        self.counts = {'extracted': 0, 'already_exists': 0, 'bytes_fetched': 0, 'range_requests': 0,
+                       'unchanged': 0}
+        self.claimed = set()
+        self.budget = ByteBudget(max_in_flight_mb * 1024 * 1024)
+        # Per archive: filings handed to the loader but not yet committed
+        self.uncommitted = {}
+        self.finishing = set()
+
+    def claim(self, object_id):
+        """Reserve a filing's output for one worker; False if it is stored or another worker has it."""
+        key = self.store.key(object_id)
+        with self.lock:
+            if key in self.claimed or self.store.exists(key):
+                return False
+            self.claimed.add(key)
+            return True
+
+    def unclaim(self, object_id):
+        key = self.store.key(object_id)
+        with self.lock:
+            if not self.store.exists(key):
+                self.claimed.discard(key)
+
+    def defer_yield(self, zip_url, object_id):
+        """Callback for the loader that records object_id as yielded once its rows are committed."""
+        with self.lock:
+            self.uncommitted[zip_url] = self.uncommitted.get(zip_url, 0) + 1
+
+        def committed():
+            self.ledger.record_yielded(zip_url, object_id)
+            with self.lock:
+                self.uncommitted[zip_url] -= 1
+                done = self.uncommitted[zip_url] == 0 and zip_url in self.finishing
+                if done:
+                    self.finishing.discard(zip_url)
+            if done:
+                self.ledger.finish(zip_url)
+        return committed
+
+    def finish_archive(self, zip_url):
+        """Mark the archive complete in the ledger, or once its last filing is committed."""
+        with self.lock:
+            if self.uncommitted.get(zip_url):
+                self.finishing.add(zip_url)
+                return
+        self.ledger.finish(zip_url)
+
+    def record_extracted(self):
+        with self.lock:
+            self.counts['extracted'] += 1
+            return self.counts['extracted']
+
+    def merge(self, counts):
+        with self.lock:
+            for key in ('already_exists', 'bytes_fetched', 'range_requests', 'unchanged'):
+                self.counts[key] += counts[key]
+
+def report_archive(zip_url, started, counts):
+    elapsed = max(time.monotonic() - started, 1e-6)
+    transferred = counts['bytes_fetched']
+    print(f"  Done with {zip_url.split('/')[-1]}: {transferred / 1e6:.1f} MB "
+          f"at {transferred / elapsed / 1e6:.1f} MB/s, process peak RSS so far {peak_rss_mb():.0f} MB")
+
+def make_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(workers, 10))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def check_available_archives(session, zip_urls, workers):
+    """HEAD every archive up front and drop the ones the IRS hasn't published."""
+    def head(zip_url):
         try:
-            print(f"Streaming {zip_url}...")
-            response = requests.get(zip_url, stream=True, timeout=300)
+            response = session.head(zip_url, timeout=60, allow_redirects=True)
+            return response.status_code, response.headers
+        except requests.RequestException:
+            return None, {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(head, [url for _, url in zip_urls]))
+
+    available = []
+    for (year, zip_url), (status, headers) in zip(zip_urls, results):
+        if status == 404:
+            continue
+        size = headers.get('Content-Length')
+        validators = validators_from_headers(headers) if status == 200 else {}
+        available.append((year, zip_url, int(size) if size and size.isdigit() else None, validators))
+    print(f"{len(available)} of {len(zip_urls)} archives available")
+    return available
+
+def process_archive(session, zip_url, size, validators, object_id_to_ein, state,
+                    use_ranges, max_memory_mb):
+    counts = {'extracted': 0, 'already_exists': 0, 'bytes_fetched': 0, 'range_requests': 0, 'unchanged': 0}
+    started = time.monotonic()
+    try:
+        entry = state.ledger.entry(zip_url)
+        if validators and entry and entry['complete'] and state.ledger.is_unchanged(zip_url, validators):
+            print(f"Unchanged since last run, skipping {zip_url}")
+            counts['unchanged'] += 1
+            return
+
+        print(f"Streaming {zip_url}...")
+
+        if use_ranges:
+            try:
+                extract_ranged_archive(session, zip_url, validators, object_id_to_ein, state, counts)
+                report_archive(zip_url, started, counts)
+                return
+            except NotModified:
+                print("  Not modified since last run (skipping)")
+                counts['unchanged'] += 1
+                return
+            except RangeNotSupported as e:
+                print(f"  Range requests unavailable for {zip_url.split('/')[-1]} ({e}), falling back to full download")
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    print("  Not found (skipping)")
+                    return
+                raise
+
+        # A full download keeps at most max_memory_mb in RAM before spilling to disk
+        reserved = min(size or max_memory_mb * 1024 * 1024, max_memory_mb * 1024 * 1024)
+        state.budget.acquire(reserved)
+        try:
+            response = session.get(zip_url, headers=state.ledger.conditional_headers(zip_url),
+                                   stream=True, timeout=300)
             if response.status_code == 404:
-                print(f"  Not found (skipping)")
-                continue
-            
-            response.raise_for_status()
-            zip_bytes = io.BytesIO(response.content)
-            
-            with zipfile.ZipFile(zip_bytes) as zf:
-                for filename in zf.namelist():
-                    if not filename.endswith('_public.xml'):
-                        continue
-                    
-                    object_id = filename.replace('_public.xml', '').split('/')[-1]
-                    
-                    if object_id not in object_id_to_ein:
-                        continue
-                    
-                    ein = object_id_to_ein[object_id]
-                    tax_period = ein_to_taxperiod.get(ein, 'unknown')
-                    
-                    save_path = os.path.join(OUTPUT_DIR, f"{ein}_{tax_period}.xml")
-                    
-                    if os.path.exists(save_path):
-                        already_exists += 1
-                    else:
-                        xml_content = zf.read(filename)
-                        with open(save_path, 'wb') as f:
-                            f.write(xml_content)
-                        extracted += 1
-                        if extracted % 25 == 0:
-                            print(f"  Extracted {extracted} files so far...")
-            
-            print(f"  Done with {zip_url.split('/')[-1]}")
-            
-        except Exception as e:
-            print(f"  Error with {zip_url}: {e}")
-    
-    return extracted, already_exists
+                print("  Not found (skipping)")
+                return
+            if response.status_code == 304:
+                print("  Not modified since last run (skipping)")
+                counts['unchanged'] += 1
+                return
+
+            with response:
+                response.raise_for_status()
+                extract_full_archive(response, zip_url, validators, object_id_to_ein,
+                                     state, counts, max_memory_mb)
+        finally:
+            state.budget.release(reserved)
+        report_archive(zip_url, started, counts)
+
+    except Exception as e:
+        print(f"  Error with {zip_url}: {e}")
+    finally:
+        state.merge(counts)
+
+def download_from_zips(object_id_to_ein, filings_df, use_ranges=True, max_memory_mb=SPOOL_MAX_MEMORY_MB,
+                       workers=1, max_in_flight_mb=MAX_IN_FLIGHT_MB, use_ledger=True, loader=None, save_xml=True,
+                       store_format='pack'):
+    if store_format == 'files':
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        ein_to_taxperiod = {}
+        for _, row in filings_df.iterrows():
+            ein = str(row['EIN'])
+            tp = str(row['TAX_PERIOD'])
+            if ein not in ein_to_taxperiod:
+                ein_to_taxperiod[ein] = tp
+        store = FileStore(object_id_to_ein, ein_to_taxperiod)
+    else:
+        object_id_to_period = dict(zip(filings_df['OBJECT_ID'].astype(str), filings_df['TAX_PERIOD'].astype(str)))
+        store = PackStore(object_id_to_ein, object_id_to_period)
+
+    session = make_session(workers)
+    zip_urls = check_available_archives(session, build_zip_urls(), workers)
+    # The store is committed before each ledger save, so a yielded member is always stored
+    ledger = DownloadLedger(fingerprint=targets_fingerprint(object_id_to_ein), before_flush=store.commit)
+    if not use_ledger:
+        ledger.entries = {}
+    state = DownloadState(max_in_flight_mb, ledger, store, loader=loader, save_xml=save_xml)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(process_archive, session, zip_url, size, validators, object_id_to_ein,
+                            state, use_ranges, max_memory_mb)
+                for _, zip_url, size, validators in zip_urls
+            ]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        # The loader's last commits still record yields, which commit the store, so it closes first
+        if loader:
+            loader.close()
+        store.close()
+
+    counts = state.counts
+    print(f"Transferred {counts['bytes_fetched'] / 1e6:.1f} MB "
+          f"({counts['range_requests']} range requests, {counts['unchanged']} archives unchanged, "
+          f"process peak RSS {peak_rss_mb():.0f} MB)")
+    return counts['extracted'], counts['already_exists']
 
 def main():
     parser = argparse.ArgumentParser(description='Download IRS 990 XML filings')
     parser.add_argument('--sample', type=int, default=None,
                         help='Only extract first N files (for testing)')
+    parser.add_argument('--no-range', action='store_true',
+                        help='Download each ZIP in full instead of fetching only the needed members')
+    parser.add_argument('--max-memory-mb', type=int, default=SPOOL_MAX_MEMORY_MB,
+                        help='Memory cap for a fully downloaded ZIP before it spills to a temp file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of archives to download and extract concurrently')
+    parser.add_argument('--max-in-flight-mb', type=int, default=MAX_IN_FLIGHT_MB,
+                        help='Cap on archive bytes held in memory across all workers')
+    parser.add_argument('--force', action='store_true',
+                        help='Ignore the download ledger and rescan every archive')
+    parser.add_argument('--store', choices=['pack', 'files'], default='pack',
+                        help='Save filings to compressed pack files (default) or one XML file each in data/raw_xml')
+    parser.add_argument('--fuse', action='store_true',
+                        help='Parse and load filings into SQLite as they are downloaded (needs PYTHONPATH=.)')
+    parser.add_argument('--parse-workers', type=int, default=2,
+                        help='Parser threads used with --fuse')
+    parser.add_argument('--no-save-xml', action='store_true',
+                        help='With --fuse, skip storing the raw XML at all')
     args = parser.parse_args()
-    
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    
+
     df = load_matched_filings()
     print(f"Loaded {len(df)} matched filings")
-    
+
     if args.sample:
         df = df.head(args.sample)
         print(f"Running in SAMPLE mode: processing first {args.sample} files")
-    
+
     object_id_to_ein = {}
     for _, row in df.iterrows():
         oid = str(row['OBJECT_ID'])
         ein = str(row['EIN'])
         object_id_to_ein[oid] = ein
-    
+
     print(f"Target OBJECT_IDs: {len(object_id_to_ein)}")
     print(f"Target EINs: {len(set(object_id_to_ein.values()))}")
-    
+
+    if args.no_save_xml and not args.fuse:
+        parser.error('--no-save-xml only makes sense together with --fuse')
+
+    loader = None
+    if args.fuse:
+        from parse_and_load import StreamingLoader
+        loader = StreamingLoader(parse_workers=args.parse_workers)
+
     print("\n--- Starting ZIP streaming ---")
-    
-    zip_extracted, zip_exists = download_from_zips(object_id_to_ein, df)
-    
+
+    zip_extracted, zip_exists = download_from_zips(
+        object_id_to_ein, df, use_ranges=not args.no_range, max_memory_mb=args.max_memory_mb,
+        workers=args.workers, max_in_flight_mb=args.max_in_flight_mb, use_ledger=not args.force,
+        loader=loader, save_xml=not args.no_save_xml, store_format=args.store)
+
     print("\n" + "=" * 50)
     print(f"Download complete!")
     print(f"  ZIP extracted: {zip_extracted}")
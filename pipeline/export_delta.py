@@ -0,0 +1,148 @@
+"""
+Change tracking for incremental exports to Supabase.
+
+The local database keeps, per exported table, a hash of every row as it was
+last pushed, keyed by the row's natural key. Comparing the current rows with
+those hashes yields the rows to upsert and the keys to delete remotely, so an
+export only moves what changed since the previous one.
+
+prospect_activity is not tracked here: it is edited in the dashboard, so the
+remote copy owns it and exports only merge into it.
+"""
+
+import hashlib
+import itertools
+import json
+
+# (table, exported columns, natural key) in load order
+EXPORT_TABLES = [
+    ('organizations', ['EIN', 'LegalName', 'City', 'State', 'NTEECode', 'SubsectionCode', 'Status', 'MissionDescription', 'WebsiteUrl', 'Phone', 'PrincipalOfficer'],
+     ['EIN']),
+    ('filings', ['EIN', 'TaxYear', 'TaxPeriodEndDate', 'TotalAssetsEOY', 'TotalLiabilitiesEOY', 'NetAssetsEOY', 'TotalRevenueCY', 'TotalRevenuePY', 'TotalExpensesCY', 'TotalExpensesPY', 'ContributionsCY', 'ProgramServiceRevenueCY', 'InvestmentIncomeCY', 'OtherRevenueCY', 'SalariesCY', 'FundraisingExpensesCY', 'ProgramExpensesAmt', 'SurplusDeficitCY', 'RawXMLPath'],
+     ['EIN', 'TaxYear']),
+    ('executive_compensation', ['EIN', 'TaxYear', 'OfficerName', 'Title', 'AverageHoursPerWeek', 'ReportableCompFromOrg', 'ReportableCompFromRelatedOrg', 'OtherCompensation'],
+     ['EIN', 'TaxYear', 'OfficerName']),
+    ('derived_metrics', ['EIN', 'TaxYear', 'RevenueGrowthYoY', 'AssetGrowthYoY', 'ProgramExpenseRatio', 'AdminExpenseRatio', 'FundraisingExpenseRatio', 'ExecCompPercentOfRevenue', 'LiabilityToAssetRatio', 'ContributionDependencyPct', 'SurplusTrend', 'LeadScore'],
+     ['EIN', 'TaxYear']),
+    ('org_latest_summary', ['EIN', 'LegalName', 'City', 'State', 'NTEECode', 'Phone', 'PrincipalOfficer', 'WebsiteUrl', 'TaxYear', 'TotalAssetsEOY', 'TotalRevenueCY', 'TotalExpensesCY', 'NetAssetsEOY', 'SurplusDeficitCY', 'RevenueGrowthYoY', 'ProgramExpenseRatio', 'AdminExpenseRatio', 'FundraisingExpenseRatio', 'ExecCompPercentOfRevenue', 'LiabilityToAssetRatio', 'ContributionDependencyPct', 'SurplusTrend', 'LeadScore', 'ContactStatus', 'IsWatchlisted'],
+     ['EIN']),
+]
+
+PROSPECT_COLUMNS = ['EIN', 'ContactStatus', 'IsWatchlisted', 'PrivateNotes', 'LastContactedDate', 'CreatedAt', 'UpdatedAt']
+
+EXPORT_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS export_state (
+    TableName TEXT NOT NULL,
+    RowKey TEXT NOT NULL,
+    RowHash TEXT NOT NULL,
+    PRIMARY KEY (TableName, RowKey)
+);
+"""
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_line(row):
+    """Render one row in PostgreSQL COPY text format (tab-separated, \\N for NULL)."""
+    return '\t'.join([
+        '\\N' if value is None else value.translate(COPY_ESCAPES) if value.__class__ is str else str(value)
+        for value in row
+    ])
+
+
+def encode_key(values):
+    return json.dumps(list(values))
+
+
+def decode_key(key):
+    return tuple(json.loads(key))
+
+
+class TableDelta:
+    """Rows to upsert and keys to delete for one table, plus the hashes to record once pushed."""
+
+    def __init__(self, table, columns, keys):
+        self.table = table
+        self.columns = columns
+        self.keys = keys
+        self.upserts = []
+        self.deletes = []
+        self.changed_hashes = {}
+        self.total = 0
+
+    def __bool__(self):
+        return bool(self.upserts or self.deletes)
+
+
+def open_export_state(conn):
+    conn.executescript(EXPORT_STATE_SCHEMA)
+
+
+def reset_export_state(conn, table):
+    conn.execute("DELETE FROM export_state WHERE TableName = ?", (table,))
+    conn.commit()
+
+
+def compute_delta(conn, table, columns, keys, collect_rows=True):
+    """
+    Compare `table` with what was last exported. With collect_rows=False the
+    changed rows are only hashed, not kept (for recording a full reload).
+    """
+    delta = TableDelta(table, columns, keys)
+    previous = dict(conn.execute(
+        "SELECT RowKey, RowHash FROM export_state WHERE TableName = ?", (table,)))
+    key_positions = [columns.index(k) for k in keys]
+    rows = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {', '.join(keys)}")
+
+    # A key with a NULL part can repeat, so rows are hashed per key group
+    for key_values, group in itertools.groupby(rows, key=lambda row: tuple(row[i] for i in key_positions)):
+        group = list(group)
+        delta.total += len(group)
+        key = encode_key(key_values)
+        digest = hashlib.sha1('\n'.join(sorted(map(copy_line, group))).encode('utf-8')).hexdigest()
+        if previous.pop(key, None) != digest:
+            delta.changed_hashes[key] = digest
+            if collect_rows:
+                delta.upserts.extend(group)
+
+    delta.deletes = [decode_key(key) for key in previous]
+    return delta
+
+
+def record_hashes(conn, table, hashes):
+    """Record {RowKey: RowHash} as exported; called per batch so an interrupted export can resume."""
+    conn.executemany(
+        "INSERT OR REPLACE INTO export_state (TableName, RowKey, RowHash) VALUES (?, ?, ?)",
+        [(table, key, digest) for key, digest in hashes.items()])
+    conn.commit()
+
+
+def forget_keys(conn, table, keys):
+    conn.executemany(
+        "DELETE FROM export_state WHERE TableName = ? AND RowKey = ?",
+        [(table, encode_key(key)) for key in keys])
+    conn.commit()
+
+
+def record_delta(conn, delta):
+    """Remember a pushed delta so the next export starts from it."""
+    record_hashes(conn, delta.table, delta.changed_hashes)
+    forget_keys(conn, delta.table, delta.deletes)
+
+
+def merge_remote_prospects(conn, remote_rows):
+    """
+    Take the remote prospect_activity rows (PROSPECT_COLUMNS order) as the
+    truth locally and carry their status into org_latest_summary. Returns the
+    number of local rows that changed.
+    """
+    local = {row[0]: row for row in conn.execute(f"SELECT {', '.join(PROSPECT_COLUMNS)} FROM prospect_activity")}
+    changed = [tuple(row) for row in remote_rows if local.get(row[0]) != tuple(row)]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO prospect_activity ({', '.join(PROSPECT_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(PROSPECT_COLUMNS))})", changed)
+    conn.executemany(
+        "UPDATE org_latest_summary SET ContactStatus = ?, IsWatchlisted = ? WHERE EIN = ?",
+        [(row[1], row[2], row[0]) for row in changed])
+    conn.commit()
+    return len(changed)
@@ -1,169 +1,326 @@
-import os
+import argparse
+import io
+import itertools
 import sqlite3
+import time
 import psycopg2
-import pandas as pd
-import sys
+
+from export_delta import (EXPORT_TABLES, PROSPECT_COLUMNS, copy_line, open_export_state,
+                          reset_export_state, compute_delta, record_delta, merge_remote_prospects)
 
 SQLITE_DB = "database/nonprofit_intelligence.db"
 
-def export_to_supabase(conn_string):
+# Rows rendered per refill while a COPY is streaming
+COPY_FETCH_ROWS = 5000
+COPY_READ_SIZE = 1024 * 1024
+
+class CopyStream(io.RawIOBase):
+    """
+    File-like view of rows (a SQLite cursor or a list) as COPY text. copy_expert
+    pulls from it with read(), so only one batch is rendered at a time.
+    """
+
+    def __init__(self, rows, fetch_rows=COPY_FETCH_ROWS):
+        self.source = iter(rows)
+        self.fetch_rows = fetch_rows
+        self.buffer = b''
+        self.pos = 0
+        self.rows = 0
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        batch = list(itertools.islice(self.source, self.fetch_rows))
+        if not batch:
+            return False
+        self.rows += len(batch)
+        text = '\n'.join(map(copy_line, batch)) + '\n'
+        self.buffer = self.buffer[self.pos:] + text.encode('utf-8')
+        self.pos = 0
+        return True
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) - self.pos < size) and self._fill():
+            pass
+        end = len(self.buffer) if size < 0 else self.pos + size
+        chunk = self.buffer[self.pos:end]
+        self.pos += len(chunk)
+        return chunk
+
+# Created if missing on every export; --full drops only the EXPORT_TABLES first
+REMOTE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS organizations (
+        EIN TEXT PRIMARY KEY,
+        LegalName TEXT,
+        City TEXT,
+        State TEXT,
+        NTEECode TEXT,
+        SubsectionCode TEXT,
+        Status TEXT,
+        MissionDescription TEXT,
+        WebsiteUrl TEXT,
+        Phone TEXT,
+        PrincipalOfficer TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS filings (
+        FilingId SERIAL PRIMARY KEY,
+        EIN TEXT NOT NULL,
+        TaxYear INTEGER,
+        TaxPeriodEndDate TEXT,
+        TotalAssetsEOY INTEGER,
+        TotalLiabilitiesEOY INTEGER,
+        NetAssetsEOY INTEGER,
+        TotalRevenueCY INTEGER,
+        TotalRevenuePY INTEGER,
+        TotalExpensesCY INTEGER,
+        TotalExpensesPY INTEGER,
+        ContributionsCY INTEGER,
+        ProgramServiceRevenueCY INTEGER,
+        InvestmentIncomeCY INTEGER,
+        OtherRevenueCY INTEGER,
+        SalariesCY INTEGER,
+        FundraisingExpensesCY INTEGER,
+        ProgramExpensesAmt INTEGER,
+        SurplusDeficitCY INTEGER,
+        RawXMLPath TEXT,
+        UNIQUE(EIN, TaxYear)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS executive_compensation (
+        ExecId SERIAL PRIMARY KEY,
+        EIN TEXT NOT NULL,
+        TaxYear INTEGER,
+        OfficerName TEXT,
+        Title TEXT,
+        AverageHoursPerWeek REAL,
+        ReportableCompFromOrg INTEGER,
+        ReportableCompFromRelatedOrg INTEGER,
+        OtherCompensation INTEGER,
+        UNIQUE(EIN, TaxYear, OfficerName)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS derived_metrics (
+        MetricId SERIAL PRIMARY KEY,
+        EIN TEXT NOT NULL,
+        TaxYear INTEGER,
+        RevenueGrowthYoY REAL,
+        AssetGrowthYoY REAL,
+        ProgramExpenseRatio REAL,
+        AdminExpenseRatio REAL,
+        FundraisingExpenseRatio REAL,
+        ExecCompPercentOfRevenue REAL,
+        LiabilityToAssetRatio REAL,
+        ContributionDependencyPct REAL,
+        SurplusTrend REAL,
+        LeadScore REAL,
+        UNIQUE(EIN, TaxYear)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS prospect_activity (
+        EIN TEXT PRIMARY KEY,
+        ContactStatus TEXT DEFAULT 'not_contacted',
+        IsWatchlisted INTEGER DEFAULT 0,
+        PrivateNotes TEXT,
+        LastContactedDate TEXT,
+        CreatedAt TEXT,
+        UpdatedAt TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS org_latest_summary (
+        EIN TEXT PRIMARY KEY,
+        LegalName TEXT,
+        City TEXT,
+        State TEXT,
+        NTEECode TEXT,
+        Phone TEXT,
+        PrincipalOfficer TEXT,
+        WebsiteUrl TEXT,
+        TaxYear INTEGER,
+        TotalAssetsEOY BIGINT,
+        TotalRevenueCY BIGINT,
+        TotalExpensesCY BIGINT,
+        NetAssetsEOY BIGINT,
+        SurplusDeficitCY BIGINT,
+        RevenueGrowthYoY REAL,
+        ProgramExpenseRatio REAL,
+        AdminExpenseRatio REAL,
+        FundraisingExpenseRatio REAL,
+        ExecCompPercentOfRevenue REAL,
+        LiabilityToAssetRatio REAL,
+        ContributionDependencyPct REAL,
+        SurplusTrend REAL,
+        LeadScore REAL,
+        ContactStatus TEXT,
+        IsWatchlisted INTEGER,
+        UpdatedAt TEXT
+    )
+    """,
+    # Saved from the dashboard, so like prospect_activity it is never dropped
+    """
+    CREATE TABLE IF NOT EXISTS scoring_profiles (
+        Name TEXT PRIMARY KEY,
+        Weights JSONB NOT NULL,
+        UpdatedAt TEXT
+    )
+    """,
+]
+
+# Dashboard snapshots refresh by fetching rows with UpdatedAt at or after their
+# watermark, so every write to these tables stamps it (UTC, sortable as text)
+TOUCHED_TABLES = ['org_latest_summary', 'prospect_activity']
+
+TOUCH_FUNCTION = """
+    CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+    BEGIN
+        NEW.UpdatedAt := to_char(clock_timestamp() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+def create_touch_triggers(pg_cursor):
+    pg_cursor.execute(TOUCH_FUNCTION)
+    for table in TOUCHED_TABLES:
+        # Tables created before UpdatedAt was exported
+        pg_cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS UpdatedAt TEXT")
+        pg_cursor.execute(f"DROP TRIGGER IF EXISTS {table}_touch ON {table}")
+        pg_cursor.execute(f"CREATE TRIGGER {table}_touch BEFORE INSERT OR UPDATE ON {table} "
+                          f"FOR EACH ROW EXECUTE FUNCTION touch_updated_at()")
+        pg_cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updatedat ON {table} (UpdatedAt)")
+
+def copy_rows(pg_cursor, table, columns, rows):
+    """Stream rows into a PostgreSQL table with COPY; returns rows copied."""
+    stream = CopyStream(rows)
+    pg_cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream, size=COPY_READ_SIZE)
+    return stream.rows
+
+def copy_table(sqlite_conn, pg_cursor, table, columns):
+    """Stream one SQLite table into the same-named PostgreSQL table with COPY; returns rows copied."""
+    source = sqlite_conn.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    return copy_rows(pg_cursor, table, columns, source)
+
+def stage_rows(pg_cursor, stage, table, columns, rows):
+    """COPY rows into a temporary table shaped like `columns` of `table`, dropped at commit."""
+    pg_cursor.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS SELECT {', '.join(columns)} FROM {table} WITH NO DATA")
+    copy_rows(pg_cursor, stage, columns, rows)
+
+def key_match(keys):
+    # EIN is never NULL; the other key columns can be, and NULL = NULL is not true
+    return ' AND '.join([f"t.{keys[0]} = s.{keys[0]}"] + [f"t.{k} IS NOT DISTINCT FROM s.{k}" for k in keys[1:]])
+
+def push_delta(pg_cursor, delta):
+    """Apply one table's TableDelta remotely: delete removed keys, then upsert changed rows."""
+    table, columns, keys = delta.table, delta.columns, delta.keys
+    if delta.deletes:
+        stage_rows(pg_cursor, f"deleted_{table}", table, keys, delta.deletes)
+        pg_cursor.execute(f"DELETE FROM {table} t USING deleted_{table} s WHERE {key_match(keys)}")
+    if not delta.upserts:
+        return
+    stage_rows(pg_cursor, f"changed_{table}", table, columns, delta.upserts)
+    if len(keys) > 1:
+        # Rows with a NULL key part never conflict, so they are replaced instead
+        null_key = ' OR '.join(f"s.{k} IS NULL" for k in keys[1:])
+        pg_cursor.execute(f"DELETE FROM {table} t USING changed_{table} s WHERE {key_match(keys)} AND ({null_key})")
+    column_list = ', '.join(columns)
+    updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in columns if c not in keys)
+    pg_cursor.execute(f"""
+        INSERT INTO {table} ({column_list}) SELECT {column_list} FROM changed_{table}
+        ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}
+    """)
+
+def sync_prospects(sqlite_conn, pg_cursor):
+    """
+    prospect_activity is edited in the dashboard, so the remote rows win: local
+    rows are only added where the remote has none, then the remote rows are
+    pulled into SQLite. Returns (rows added remotely, local rows updated).
+    """
+    column_list = ', '.join(PROSPECT_COLUMNS)
+    pg_cursor.execute(f"SELECT {column_list} FROM prospect_activity")
+    remote = pg_cursor.fetchall()
+    remote_eins = {row[0] for row in remote}
+    local_only = [row for row in sqlite_conn.execute(f"SELECT {column_list} FROM prospect_activity")
+                  if row[0] not in remote_eins]
+    added = 0
+    if local_only:
+        stage_rows(pg_cursor, "local_prospect_activity", "prospect_activity", PROSPECT_COLUMNS, local_only)
+        pg_cursor.execute(f"""
+            INSERT INTO prospect_activity ({column_list}) SELECT {column_list} FROM local_prospect_activity
+            ON CONFLICT (EIN) DO NOTHING
+        """)
+        added = pg_cursor.rowcount
+    return added, merge_remote_prospects(sqlite_conn, remote)
+
+def is_tracked(sqlite_conn, table):
+    return sqlite_conn.execute("SELECT 1 FROM export_state WHERE TableName = ? LIMIT 1", (table,)).fetchone() is not None
+
+def export_to_supabase(conn_string, full=False):
     conn = sqlite3.connect(SQLITE_DB)
-    
-    print("Reading from SQLite...")
-    orgs = pd.read_sql_query("SELECT * FROM organizations", conn)
-    filings = pd.read_sql_query("SELECT * FROM filings", conn)
-    exec_comp = pd.read_sql_query("SELECT * FROM executive_compensation", conn)
-    metrics = pd.read_sql_query("SELECT * FROM derived_metrics", conn)
-    prospect = pd.read_sql_query("SELECT * FROM prospect_activity", conn)
-    conn.close()
+    open_export_state(conn)
     
     print("Connecting to Supabase...")
     pg_conn = psycopg2.connect(conn_string)
     cursor = pg_conn.cursor()
     
-    print("Creating tables...")
-    cursor.execute("DROP TABLE IF EXISTS organizations CASCADE")
-    cursor.execute("DROP TABLE IF EXISTS filings CASCADE")
-    cursor.execute("DROP TABLE IF EXISTS executive_compensation CASCADE")
-    cursor.execute("DROP TABLE IF EXISTS derived_metrics CASCADE")
-    cursor.execute("DROP TABLE IF EXISTS prospect_activity CASCADE")
-    pg_conn.commit()
-    
-    cursor.execute("""
-        CREATE TABLE organizations (
-            EIN TEXT PRIMARY KEY,
-            LegalName TEXT,
-            City TEXT,
-            State TEXT,
-            NTEECode TEXT,
-            SubsectionCode TEXT,
-            Status TEXT,
-            MissionDescription TEXT,
-            WebsiteUrl TEXT,
-            Phone TEXT,
-            PrincipalOfficer TEXT
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE filings (
-            FilingId SERIAL PRIMARY KEY,
-            EIN TEXT NOT NULL,
-            TaxYear INTEGER,
-            TaxPeriodEndDate TEXT,
-            TotalAssetsEOY INTEGER,
-            TotalLiabilitiesEOY INTEGER,
-            NetAssetsEOY INTEGER,
-            TotalRevenueCY INTEGER,
-            TotalRevenuePY INTEGER,
-            TotalExpensesCY INTEGER,
-            TotalExpensesPY INTEGER,
-            ContributionsCY INTEGER,
-            ProgramServiceRevenueCY INTEGER,
-            InvestmentIncomeCY INTEGER,
-            OtherRevenueCY INTEGER,
-            SalariesCY INTEGER,
-            FundraisingExpensesCY INTEGER,
-            ProgramExpensesAmt INTEGER,
-            SurplusDeficitCY INTEGER,
-            RawXMLPath TEXT,
-            UNIQUE(EIN, TaxYear)
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE executive_compensation (
-            ExecId SERIAL PRIMARY KEY,
-            EIN TEXT NOT NULL,
-            TaxYear INTEGER,
-            OfficerName TEXT,
-            Title TEXT,
-            AverageHoursPerWeek REAL,
-            ReportableCompFromOrg INTEGER,
-            ReportableCompFromRelatedOrg INTEGER,
-            OtherCompensation INTEGER,
-            UNIQUE(EIN, TaxYear, OfficerName)
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE derived_metrics (
-            MetricId SERIAL PRIMARY KEY,
-            EIN TEXT NOT NULL,
-            TaxYear INTEGER,
-            RevenueGrowthYoY REAL,
-            AssetGrowthYoY REAL,
-            ProgramExpenseRatio REAL,
-            AdminExpenseRatio REAL,
-            FundraisingExpenseRatio REAL,
-            ExecCompPercentOfRevenue REAL,
-            LiabilityToAssetRatio REAL,
-            ContributionDependencyPct REAL,
-            SurplusTrend REAL,
-            LeadScore REAL,
-            UNIQUE(EIN, TaxYear)
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE prospect_activity (
-            EIN TEXT PRIMARY KEY,
-            ContactStatus TEXT DEFAULT 'not_contacted',
-            IsWatchlisted INTEGER DEFAULT 0,
-            PrivateNotes TEXT,
-            LastContactedDate TEXT,
-            CreatedAt TEXT,
-            UpdatedAt TEXT
-        )
-    """)
-    
-    pg_conn.commit()
-    
-    print(f"Inserting {len(orgs)} organizations...")
-    cols = ['EIN', 'LegalName', 'City', 'State', 'NTEECode', 'SubsectionCode', 'Status', 'MissionDescription', 'WebsiteUrl', 'Phone', 'PrincipalOfficer']
-    values = [tuple(x if pd.notna(x) else None for x in row) for row in orgs[cols].values]
-    from psycopg2.extras import execute_values
-    execute_values(cursor, "INSERT INTO organizations (EIN, LegalName, City, State, NTEECode, SubsectionCode, Status, MissionDescription, WebsiteUrl, Phone, PrincipalOfficer) VALUES %s", values)
-    pg_conn.commit()
-    print(f"  Done!")
+    if full:
+        print("Dropping exported tables...")
+        for table, _, _ in EXPORT_TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
     
-    print(f"Inserting {len(filings)} filings...")
-    cols = ['EIN', 'TaxYear', 'TaxPeriodEndDate', 'TotalAssetsEOY', 'TotalLiabilitiesEOY', 'NetAssetsEOY', 'TotalRevenueCY', 'TotalRevenuePY', 'TotalExpensesCY', 'TotalExpensesPY', 'ContributionsCY', 'ProgramServiceRevenueCY', 'InvestmentIncomeCY', 'OtherRevenueCY', 'SalariesCY', 'FundraisingExpensesCY', 'ProgramExpensesAmt', 'SurplusDeficitCY', 'RawXMLPath']
-    values = [tuple(x if pd.notna(x) else None for x in row) for row in filings[cols].values]
-    execute_values(cursor, "INSERT INTO filings (EIN, TaxYear, TaxPeriodEndDate, TotalAssetsEOY, TotalLiabilitiesEOY, NetAssetsEOY, TotalRevenueCY, TotalRevenuePY, TotalExpensesCY, TotalExpensesPY, ContributionsCY, ProgramServiceRevenueCY, InvestmentIncomeCY, OtherRevenueCY, SalariesCY, FundraisingExpensesCY, ProgramExpensesAmt, SurplusDeficitCY, RawXMLPath) VALUES %s", values)
+    print("Creating missing tables...")
+    for ddl in REMOTE_TABLES:
+        cursor.execute(ddl)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_org_latest_summary_state_score ON org_latest_summary (State, LeadScore)")
+    create_touch_triggers(cursor)
     pg_conn.commit()
-    print(f"  Done!")
-    
-    print(f"Inserting {len(exec_comp)} executive compensation records...")
-    if len(exec_comp) > 0:
-        cols = ['EIN', 'TaxYear', 'OfficerName', 'Title', 'AverageHoursPerWeek', 'ReportableCompFromOrg', 'ReportableCompFromRelatedOrg', 'OtherCompensation']
-        values = [tuple(x if pd.notna(x) else None for x in row) for row in exec_comp[cols].values]
-        execute_values(cursor, "INSERT INTO executive_compensation (EIN, TaxYear, OfficerName, Title, AverageHoursPerWeek, ReportableCompFromOrg, ReportableCompFromRelatedOrg, OtherCompensation) VALUES %s", values)
-        pg_conn.commit()
-    print(f"  Done!")
     
-    print(f"Inserting {len(metrics)} derived metrics...")
-    cols = ['EIN', 'TaxYear', 'RevenueGrowthYoY', 'AssetGrowthYoY', 'ProgramExpenseRatio', 'AdminExpenseRatio', 'FundraisingExpenseRatio', 'ExecCompPercentOfRevenue', 'LiabilityToAssetRatio', 'ContributionDependencyPct', 'SurplusTrend', 'LeadScore']
-    values = [tuple(x if pd.notna(x) else None for x in row) for row in metrics[cols].values]
-    execute_values(cursor, "INSERT INTO derived_metrics (EIN, TaxYear, RevenueGrowthYoY, AssetGrowthYoY, ProgramExpenseRatio, AdminExpenseRatio, FundraisingExpenseRatio, ExecCompPercentOfRevenue, LiabilityToAssetRatio, ContributionDependencyPct, SurplusTrend, LeadScore) VALUES %s", values)
+    started = time.monotonic()
+    added, pulled = sync_prospects(conn, cursor)
     pg_conn.commit()
-    print(f"  Done!")
+    print(f"prospect_activity: {added} local rows added, {pulled} rows pulled from Supabase")
     
-    print(f"Inserting {len(prospect)} prospect activity records...")
-    if len(prospect) > 0:
-        cols = ['EIN', 'ContactStatus', 'IsWatchlisted', 'PrivateNotes', 'LastContactedDate', 'CreatedAt', 'UpdatedAt']
-        values = [tuple(x if pd.notna(x) else None for x in row) for row in prospect[cols].values]
-        execute_values(cursor, "INSERT INTO prospect_activity (EIN, ContactStatus, IsWatchlisted, PrivateNotes, LastContactedDate, CreatedAt, UpdatedAt) VALUES %s", values)
+    for table, columns, keys in EXPORT_TABLES:
+        table_started = time.monotonic()
+        if full or not is_tracked(conn, table):
+            # Nothing recorded to diff against, so reload the table and start tracking it
+            print(f"Copying {table}...")
+            cursor.execute(f"TRUNCATE {table}")
+            rows = copy_table(conn, cursor, table, columns)
+            pg_conn.commit()
+            reset_export_state(conn, table)
+            record_delta(conn, compute_delta(conn, table, columns, keys, collect_rows=False))
+            print(f"  {rows} rows in {time.monotonic() - table_started:.1f}s")
+            continue
+        
+        delta = compute_delta(conn, table, columns, keys)
+        push_delta(cursor, delta)
         pg_conn.commit()
-    print(f"  Done!")
+        record_delta(conn, delta)
+        print(f"{table}: {len(delta.upserts)} upserted, {len(delta.deletes)} deleted "
+              f"of {delta.total} rows in {time.monotonic() - table_started:.1f}s")
+    conn.close()
+    print(f"Exported all tables in {time.monotonic() - started:.1f}s")
     
     cursor.close()
     pg_conn.close()
     
     print("Done! Data exported to Supabase.")
 
+def main():
+    parser = argparse.ArgumentParser(description="Export the SQLite database to Supabase PostgreSQL")
+    parser.add_argument('conn_string', help="PostgreSQL connection string")
+    parser.add_argument('--full', action='store_true',
+                        help="Drop and reload the exported tables instead of pushing only changed rows "
+                             "(prospect_activity and scoring_profiles are kept)")
+    args = parser.parse_args()
+    export_to_supabase(args.conn_string, full=args.full)
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python export_to_supabase.py '<connection_string>'")
-        sys.exit(1)
-    export_to_supabase(sys.argv[1])
+    main()
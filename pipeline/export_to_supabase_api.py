@@ -2,21 +2,68 @@
 Export SQLite data to Supabase via the Supabase REST API (SDK).
 
 Usage:
-    SUPABASE_URL=https://... SUPABASE_KEY=... python pipeline/export_to_supabase_api.py
+    SUPABASE_URL=https://... SUPABASE_KEY=... python pipeline/export_to_supabase_api.py [--full] [--workers N]
 
 Credentials are read from environment variables SUPABASE_URL and SUPABASE_KEY.
+By default only rows changed since the last export are pushed (see export_delta.py).
+
+Every write is an upsert on the table's key or a delete by key, so requests
+can be retried and run concurrently. Each batch is recorded in export_state
+as soon as it is stored, so rerunning after an interruption (without --full)
+continues where the last run stopped.
 """
 
-import math
+import argparse
+import json
 import os
+import random
 import sqlite3
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
+import httpx
+import numpy as np
 import pandas as pd
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
 from supabase import create_client
 
+from export_delta import (EXPORT_TABLES, PROSPECT_COLUMNS, encode_key, open_export_state, reset_export_state,
+                          compute_delta, record_hashes, forget_keys, merge_remote_prospects)
+
 SQLITE_DB = "database/nonprofit_intelligence.db"
 
+# Tables this exporter maintains, in load order
+API_TABLES = ['organizations', 'filings', 'derived_metrics', 'org_latest_summary']
+
+# PostgREST returns at most this many rows per request
+FETCH_PAGE_SIZE = 1000
+
+# Requests in flight at once over the shared client
+UPLOAD_WORKERS = 8
+
+# Upsert batches start at FIRST_BATCH_ROWS and then grow while requests finish
+# well under TARGET_REQUEST_SECONDS, shrinking when they take longer
+FIRST_BATCH_ROWS = 500
+MIN_BATCH_ROWS = 50
+MAX_BATCH_ROWS = 5000
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+TARGET_REQUEST_SECONDS = 1.0
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 0.5
+
+# PostgreSQL error classes a retry can fix: connection exceptions, serialization
+# failures and deadlocks, insufficient resources, cancelled or timed-out
+# statements and server shutdowns, and system errors
+TRANSIENT_SQLSTATE_CLASSES = ('08', '40', '53', '57', '58')
+# PostgREST could not reach or get a connection to the database
+TRANSIENT_POSTGREST_CODES = ('PGRST000', 'PGRST001', 'PGRST002', 'PGRST003')
+
+# EINs per DELETE ... ein=in.(...) request, keeping the URL short
+DELETE_CHUNK = 200
+
 
 def get_client():
     url = os.environ.get("SUPABASE_URL")
@@ -27,60 +74,244 @@ def get_client():
     return create_client(url, key)
 
 
-def clean_value(v):
-    if v is None:
-        return None
-    if isinstance(v, float):
-        if math.isnan(v) or math.isinf(v):
-            return None
-        if v == int(v):
-            return int(v)
-    return v
+def clean_frame(df):
+    """
+    JSON-ready records with lowercase keys: NaN and inf become None and whole
+    floats become ints (SQLite integers with NULLs arrive as float columns).
+    """
+    columns = []
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if values.dtype.kind == 'f':
+            finite = np.isfinite(values)
+            whole = finite & (values == np.trunc(values))
+            cleaned = np.full(len(values), None, dtype=object)
+            cleaned[finite] = values[finite].tolist()
+            cleaned[whole] = values[whole].astype(np.int64).tolist()
+        elif values.dtype.kind in 'iub':
+            cleaned = values.tolist()
+        else:
+            cleaned = values.copy()
+            cleaned[pd.isna(values)] = None
+        columns.append(cleaned)
+    names = [c.lower() for c in df.columns]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def is_transient(error):
+    """True for failures worth retrying: 5xx, 429, dropped connections and timeouts."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, APIError):
+        code = '' if error.code is None else str(error.code)
+        # PostgREST and PostgreSQL errors always carry a code; errors without one
+        # come from the gateway in front of it (rate limits, unavailable upstream)
+        if not code:
+            return True
+        # A response that was not JSON reports its HTTP status as the code
+        if code.isdigit() and len(code) == 3:
+            return int(code) >= 500 or int(code) == 429
+        return code in TRANSIENT_POSTGREST_CODES or code[:2] in TRANSIENT_SQLSTATE_CLASSES
+    return False
+
+
+def with_retries(request):
+    """Run request(), retrying transient failures with jittered exponential backoff."""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return request()
+        except (APIError, httpx.HTTPError) as e:
+            if attempt == MAX_ATTEMPTS or not is_transient(e):
+                raise
+            delay = RETRY_BASE_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            print(f"  Request failed ({e}); retry {attempt}/{MAX_ATTEMPTS - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class BatchSizer:
+    """Rows per upsert request, adapted to the payload size and observed latency."""
+
+    def __init__(self, records):
+        sample = records[:50]
+        row_bytes = max(1, len(json.dumps(sample, default=str)) // max(1, len(sample)))
+        self.max_rows = max(MIN_BATCH_ROWS, min(MAX_BATCH_ROWS, MAX_BATCH_BYTES // row_bytes))
+        self.rows = min(FIRST_BATCH_ROWS, self.max_rows)
+
+    def observe(self, rows, seconds):
+        # Only batches at the current size say anything about it
+        if rows < self.rows:
+            return
+        if seconds > TARGET_REQUEST_SECONDS:
+            self.rows = int(self.rows * TARGET_REQUEST_SECONDS / seconds)
+        elif seconds < TARGET_REQUEST_SECONDS / 2:
+            self.rows = int(self.rows * 1.5)
+        self.rows = max(MIN_BATCH_ROWS, min(self.max_rows, self.rows))
+
 
+class UploadPool:
+    """Runs retried requests on the shared client with up to `workers` in flight."""
 
-def clean_record(record):
-    return {k: clean_value(v) for k, v in record.items()}
+    def __init__(self, client, workers=UPLOAD_WORKERS):
+        self.client = client
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
 
+    def close(self):
+        self.executor.shutdown()
 
-def insert_batched(client, table_name, df, batch_size=100):
-    df.columns = [c.lower() for c in df.columns]
-    for i in range(0, len(df), batch_size):
-        batch = [clean_record(r) for r in df.iloc[i:i + batch_size].to_dict('records')]
-        client.table(table_name).insert(batch).execute()
-    print(f"  {len(df)} records inserted into {table_name}")
+    def _timed(self, send, batch):
+        started = time.monotonic()
+        with_retries(lambda: send(batch))
+        return time.monotonic() - started
+
+    def upsert(self, table_name, records, on_conflict, on_done=None, keys=None, ignore_duplicates=False):
+        """
+        Upsert records in adaptively sized batches. on_done(start, end) runs on
+        the calling thread once records[start:end] are stored. Records with
+        equal `keys` entries are kept in the same batch.
+        """
+        def send(batch):
+            self.client.table(table_name).upsert(
+                batch, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates,
+                returning=ReturnMethod.minimal).execute()
+
+        sizer = BatchSizer(records)
+        pending = {}
+        start = 0
+        while start < len(records) or pending:
+            while start < len(records) and len(pending) < self.workers:
+                end = min(len(records), start + sizer.rows)
+                while keys is not None and end < len(records) and keys[end] == keys[end - 1]:
+                    end += 1
+                pending[self.executor.submit(self._timed, send, records[start:end])] = (start, end)
+                start = end
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch_start, batch_end = pending.pop(future)
+                sizer.observe(batch_end - batch_start, future.result())
+                if on_done:
+                    on_done(batch_start, batch_end)
+
+    def delete_keys(self, table_name, key_columns, key_rows, on_done=None):
+        """
+        Delete rows by key, one request per DELETE_CHUNK EINs that share the
+        rest of the key. on_done(key_rows) runs once a request has succeeded.
+        """
+        groups = {}
+        for values in key_rows:
+            groups.setdefault(tuple(values[1:]), []).append(values[0])
+
+        def send(rest, eins):
+            query = self.client.table(table_name).delete(returning=ReturnMethod.minimal).in_(key_columns[0].lower(), eins)
+            for column, value in zip(key_columns[1:], rest):
+                query = query.is_(column.lower(), 'null') if value is None else query.eq(column.lower(), value)
+            query.execute()
+
+        futures = {}
+        for rest, eins in groups.items():
+            for i in range(0, len(eins), DELETE_CHUNK):
+                chunk = eins[i:i + DELETE_CHUNK]
+                futures[self.executor.submit(with_retries, lambda rest=rest, chunk=chunk: send(rest, chunk))] = (rest, chunk)
+        for future in as_completed(futures):
+            future.result()
+            if on_done:
+                rest, chunk = futures[future]
+                on_done([(ein,) + rest for ein in chunk])
+
+
+def fetch_all(client, table_name, columns):
+    """Every row of a remote table as tuples in `columns` order."""
+    names = [c.lower() for c in columns]
+    rows = []
+    while True:
+        page = with_retries(lambda: client.table(table_name).select(','.join(names))
+                            .range(len(rows), len(rows) + FETCH_PAGE_SIZE - 1).execute().data)
+        rows.extend(tuple(record[n] for n in names) for record in page)
+        if len(page) < FETCH_PAGE_SIZE:
+            return rows
+
+
+def push_delta(pool, conn, delta):
+    """
+    Apply one table's TableDelta: delete removed keys, then upsert changed rows
+    on the table's key, recording each batch in export_state as it lands.
+    """
+    table = delta.table
+    pool.delete_keys(table, delta.keys, delta.deletes, on_done=lambda done: forget_keys(conn, table, done))
+    if not delta.upserts:
+        return
+    key_positions = [delta.columns.index(k) for k in delta.keys]
+    row_keys = [encode_key(row[i] for i in key_positions) for row in delta.upserts]
+    # Rows with a NULL key part never conflict, so they are replaced instead
+    null_keys = {tuple(row[i] for i in key_positions) for row in delta.upserts
+                 if any(row[i] is None for i in key_positions)}
+    pool.delete_keys(table, delta.keys, null_keys)
+
+    def on_done(start, end):
+        record_hashes(conn, table, {key: delta.changed_hashes[key] for key in row_keys[start:end]})
+
+    records = clean_frame(pd.DataFrame.from_records(delta.upserts, columns=delta.columns))
+    pool.upsert(table, records, ','.join(k.lower() for k in delta.keys), on_done=on_done, keys=row_keys)
+
+
+def sync_prospects(pool, conn):
+    """
+    prospect_activity is edited in the dashboard, so the remote rows win: local
+    rows are only inserted where the remote has none, then the remote rows are
+    pulled into SQLite.
+    """
+    remote = fetch_all(pool.client, 'prospect_activity', PROSPECT_COLUMNS)
+    remote_eins = {row[0] for row in remote}
+    local_only = pd.read_sql_query(f"SELECT {', '.join(PROSPECT_COLUMNS)} FROM prospect_activity", conn)
+    local_only = local_only[~local_only['EIN'].isin(remote_eins)]
+    if len(local_only) > 0:
+        pool.upsert('prospect_activity', clean_frame(local_only), 'ein', ignore_duplicates=True)
+        print(f"  {len(local_only)} local prospect records added")
+    print(f"  {merge_remote_prospects(conn, remote)} prospect records pulled from Supabase")
 
 
 def main():
-    client = get_client()
+    parser = argparse.ArgumentParser(description="Export the SQLite database through the Supabase REST API")
+    parser.add_argument('--full', action='store_true',
+                        help="Delete and reinsert every exported table instead of pushing only changed rows "
+                             "(prospect_activity is kept)")
+    parser.add_argument('--workers', type=int, default=UPLOAD_WORKERS,
+                        help=f"Concurrent requests (default: {UPLOAD_WORKERS})")
+    args = parser.parse_args()
 
-    print("Reading from SQLite...")
+    pool = UploadPool(get_client(), args.workers)
     conn = sqlite3.connect(SQLITE_DB)
-    orgs = pd.read_sql_query("SELECT * FROM organizations", conn)
-    filings = pd.read_sql_query("SELECT * FROM filings", conn)
-    metrics = pd.read_sql_query("SELECT * FROM derived_metrics", conn)
-    prospect = pd.read_sql_query("SELECT * FROM prospect_activity", conn)
-    conn.close()
-
-    print(f"  Organizations: {len(orgs)}")
-    print(f"  Filings:       {len(filings)}")
-    print(f"  Metrics:       {len(metrics)}")
-    print(f"  Prospect:      {len(prospect)}")
-
-    print("\nDeleting existing data...")
-    client.table('prospect_activity').delete().neq('ein', '').execute()
-    client.table('derived_metrics').delete().neq('ein', '').execute()
-    client.table('filings').delete().neq('ein', '').execute()
-    client.table('organizations').delete().neq('ein', '').execute()
-
-    print("\nInserting data...")
-    insert_batched(client, 'organizations', orgs)
-    insert_batched(client, 'filings', filings)
-    if len(metrics) > 0:
-        insert_batched(client, 'derived_metrics', metrics)
-    if len(prospect) > 0:
-        insert_batched(client, 'prospect_activity', prospect)
-
-    print("\nDone! Data exported to Supabase.")
+    open_export_state(conn)
+    started = time.monotonic()
+
+    try:
+        print("Merging prospect activity...")
+        sync_prospects(pool, conn)
+
+        for table, columns, keys in EXPORT_TABLES:
+            if table not in API_TABLES:
+                continue
+            table_started = time.monotonic()
+            tracked = conn.execute("SELECT 1 FROM export_state WHERE TableName = ? LIMIT 1", (table,)).fetchone()
+            if args.full or not tracked:
+                # Nothing recorded to diff against, so empty the table and push every row
+                print(f"Reloading {table}...")
+                reset_export_state(conn, table)
+                with_retries(lambda: pool.client.table(table).delete(returning=ReturnMethod.minimal).neq('ein', '').execute())
+
+            delta = compute_delta(conn, table, columns, keys)
+            push_delta(pool, conn, delta)
+            elapsed = time.monotonic() - table_started
+            print(f"  {table}: {len(delta.upserts)} upserted, {len(delta.deletes)} deleted of {delta.total} rows "
+                  f"in {elapsed:.1f}s ({len(delta.upserts) / max(elapsed, 1e-9):.0f} rows/s)")
+    finally:
+        pool.close()
+        conn.close()
+
+    print(f"\nDone! Data exported to Supabase in {time.monotonic() - started:.1f}s.")
 
 
 if __name__ == "__main__":
@@ -1,12 +1,54 @@
 import os
+import argparse
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
 from lxml import etree
-from database.db_setup import get_connection, get_db_path
+from database.db_setup import (get_connection, get_db_path, bulk_load_profile, apply_schema,
+                               refresh_org_latest_summary)
+from xml_store import PACK_DIR, INDEX_FILE, XMLPackReader, is_pack_ref
+from parse_ledger import (LEDGER_SQL, content_hash, load_ledger, entry_key, plan_sources,
+                          sources_for_keys, remove_sources)
 
 XML_DIR = "data/raw_xml"
+PARSE_CHUNK_SIZE = 64
+BATCH_SIZE = 500
 
 NS = {'efile': 'http://www.irs.gov/efile'}
 
+_pack_reader = None
+
+def get_pack_reader():
+    global _pack_reader
+    if _pack_reader is None:
+        _pack_reader = XMLPackReader()
+    return _pack_reader
+
+def scan_sources():
+    """
+    (path, size, mtime, sha1) for raw XML files in XML_DIR and filings in the pack store.
+    Files have no hash until they are read; pack filings have no mtime.
+    """
+    sources = []
+    if os.path.isdir(XML_DIR):
+        for entry in os.scandir(XML_DIR):
+            if entry.name.endswith('.xml'):
+                st = entry.stat()
+                sources.append((entry.path, st.st_size, st.st_mtime, None))
+    if os.path.exists(os.path.join(PACK_DIR, INDEX_FILE)):
+        sources.extend((ref, size, None, sha1) for ref, size, sha1 in get_pack_reader().ref_stats())
+    return sources
+
+def source_row(path, content):
+    """(path, size, mtime, sha1) for a source whose content has just been read."""
+    if is_pack_ref(path):
+        return (path, len(content), None, content_hash(content))
+    st = os.stat(path)
+    return (path, st.st_size, st.st_mtime, content_hash(content))
+
 def parse_int(value):
     if value is None or value == '':
         return None
@@ -23,99 +65,210 @@ def parse_float(value):
     except (ValueError, AttributeError):
         return None
 
-def get_text(elem, xpath_expr):
-    try:
-        result = elem.xpath(xpath_expr, namespaces=NS)
-        if result:
-            text = result[0].text
-            return text.strip() if text else None
-    except:
-        pass
-    return None
-
-def get_text_or_none(elem, xpath_expr):
-    result = get_text(elem, xpath_expr)
-    return result if result and result.strip() else None
-
-def parse_xml_file(filepath):
+# Declarative map of everything parse_xml_file reads from a return:
+# (key, element tag, scope, required parent tags nearest-first).
+# Scope 'root' matches anywhere below the root, 'IRS990' / 'ReturnHeader' only
+# below the first element of that name. Each key takes the first element in
+# document order that satisfies its scope and parents, which is exactly what
+# the './/efile:...' XPath lookups this replaces returned.
+FILING_FIELDS = [
+    ('EIN', 'EIN', 'root', ('Filer',)),
+    ('OrgName', 'BusinessNameLine1Txt', 'root', ('BusinessName', 'Filer')),
+    ('State', 'StateAbbreviationCd', 'root', ('USAddress', 'Filer')),
+    ('City', 'CityNm', 'root', ('USAddress', 'Filer')),
+    ('TaxYear', 'TaxYr', 'root', ()),
+    ('TaxPeriodEndDate', 'TaxPeriodEndDt', 'root', ()),
+    ('NTEECode', 'NTEECd', 'root', ('Filer',)),
+    ('Phone', 'PhoneNum', 'root', ()),
+    ('PrincipalOfficer', 'PrincipalOfficerNm', 'root', ('IRS990',)),
+    ('PartVIIPersonName', 'PersonNm', 'root', ('Form990PartVIISectionAGrp',)),
+    ('PartVII', 'Form990PartVIISectionAGrp', 'root', ()),
+    ('IRS990', 'IRS990', 'root', ()),
+    ('ReturnHeader', 'ReturnHeader', 'root', ()),
+    ('TotalAssetsEOYAmt', 'TotalAssetsEOYAmt', 'IRS990', ()),
+    ('TotalLiabilitiesEOYAmt', 'TotalLiabilitiesEOYAmt', 'IRS990', ()),
+    ('NetAssetsOrFundBalancesEOYAmt', 'NetAssetsOrFundBalancesEOYAmt', 'IRS990', ()),
+    ('CYTotalRevenueAmt', 'CYTotalRevenueAmt', 'IRS990', ()),
+    ('PYTotalRevenueAmt', 'PYTotalRevenueAmt', 'IRS990', ()),
+    ('CYTotalExpensesAmt', 'CYTotalExpensesAmt', 'IRS990', ()),
+    ('PYTotalExpensesAmt', 'PYTotalExpensesAmt', 'IRS990', ()),
+    ('CYContributionsGrantsAmt', 'CYContributionsGrantsAmt', 'IRS990', ()),
+    ('CYProgramServiceRevenueAmt', 'CYProgramServiceRevenueAmt', 'IRS990', ()),
+    ('CYInvestmentIncomeAmt', 'CYInvestmentIncomeAmt', 'IRS990', ()),
+    ('CYSalariesCompEmpBnftPaidAmt', 'CYSalariesCompEmpBnftPaidAmt', 'IRS990', ()),
+    ('CYTotalProfFndrsngExpnsAmt', 'CYTotalProfFndrsngExpnsAmt', 'IRS990', ()),
+    ('TotalProgramServiceExpensesAmt', 'TotalProgramServiceExpensesAmt', 'IRS990', ()),
+    ('CYOtherRevenueAmt', 'CYOtherRevenueAmt', 'IRS990', ()),
+    ('CYTotalOtherIncAmt', 'CYTotalOtherIncAmt', 'IRS990', ()),
+    ('MissionDesc', 'MissionDesc', 'IRS990', ()),
+    ('ActivityOrMissionDesc', 'ActivityOrMissionDesc', 'IRS990', ()),
+    ('WebsiteUrl', 'WebsiteAddressTxt', 'IRS990', ()),
+    ('HeaderOrgName', 'BusinessNameLine1Txt', 'ReturnHeader', ('BusinessName', 'Filer')),
+    ('HeaderState', 'StateAbbreviationCd', 'ReturnHeader', ('USAddress', 'Filer')),
+    ('HeaderCity', 'CityNm', 'ReturnHeader', ('USAddress', 'Filer')),
+]
+
+IRS990_AMOUNT_FIELDS = [
+    ('TotalAssetsEOY', 'TotalAssetsEOYAmt'),
+    ('TotalLiabilitiesEOY', 'TotalLiabilitiesEOYAmt'),
+    ('NetAssetsEOY', 'NetAssetsOrFundBalancesEOYAmt'),
+    ('TotalRevenueCY', 'CYTotalRevenueAmt'),
+    ('TotalRevenuePY', 'PYTotalRevenueAmt'),
+    ('TotalExpensesCY', 'CYTotalExpensesAmt'),
+    ('TotalExpensesPY', 'PYTotalExpensesAmt'),
+    ('ContributionsCY', 'CYContributionsGrantsAmt'),
+    ('ProgramServiceRevenueCY', 'CYProgramServiceRevenueAmt'),
+    ('InvestmentIncomeCY', 'CYInvestmentIncomeAmt'),
+    ('SalariesCY', 'CYSalariesCompEmpBnftPaidAmt'),
+    ('FundraisingExpensesCY', 'CYTotalProfFndrsngExpnsAmt'),
+    ('ProgramExpensesAmt', 'TotalProgramServiceExpensesAmt'),
+]
+
+# Part VII officer fields: first descendant with each tag below one officer entry
+OFFICER_FIELDS = [
+    ('OfficerName', 'PersonNm'),
+    ('Title', 'TitleTxt'),
+    ('AverageHoursPerWeek', 'AverageHoursPerWeekRt'),
+    ('ReportableCompFromOrg', 'ReportableCompFromOrgAmt'),
+    ('ReportableCompFromRelatedOrg', 'ReportableCompFromRltdOrgAmt'),
+    ('OtherCompensation', 'OtherCompensationAmt'),
+]
+
+def _qualify(tag):
+    return '{%s}%s' % (NS['efile'], tag)
+
+def _compile_dispatch(fields):
+    dispatch = {}
+    for key, tag, scope, parents in fields:
+        dispatch.setdefault(_qualify(tag), []).append(
+            (key, scope, tuple(_qualify(p) for p in parents))
+        )
+    return dispatch
+
+FILING_DISPATCH = _compile_dispatch(FILING_FIELDS)
+OFFICER_DISPATCH = {_qualify(tag): key for key, tag in OFFICER_FIELDS}
+
+def _has_parents(elem, parents):
+    for parent_tag in parents:
+        elem = elem.getparent()
+        if elem is None or elem.tag != parent_tag:
+            return False
+    return True
+
+def _is_descendant(elem, ancestor):
+    for parent in elem.iterancestors():
+        if parent is ancestor:
+            return True
+    return False
+
+def extract_fields(root):
+    """Walk the tree once and return {key: first matching element} for FILING_FIELDS."""
+    found = {}
+    for elem in root.iterdescendants(tag=etree.Element):
+        specs = FILING_DISPATCH.get(elem.tag)
+        if specs is None:
+            continue
+        for key, scope, parents in specs:
+            if key in found:
+                continue
+            if scope != 'root':
+                scope_root = found.get(scope)
+                if scope_root is None or not _is_descendant(elem, scope_root):
+                    continue
+            if parents and not _has_parents(elem, parents):
+                continue
+            found[key] = elem
+    return found
+
+def extract_officer_fields(officer):
+    found = {}
+    for elem in officer.iterdescendants(tag=etree.Element):
+        key = OFFICER_DISPATCH.get(elem.tag)
+        if key is not None and key not in found:
+            found[key] = elem
+    return found
+
+def _element_text(elem):
+    if elem is None:
+        return None
+    text = elem.text
+    return text.strip() if text else None
+
+def _none_if_blank(value):
+    return value if value and value.strip() else None
+
+def parse_xml_file(filepath, content=None):
     try:
-        tree = etree.parse(filepath)
-        root = tree.getroot()
+        if content is None and is_pack_ref(filepath):
+            content = get_pack_reader().read_ref(filepath)
+        if content is not None:
+            root = etree.fromstring(content)
+        else:
+            tree = etree.parse(filepath)
+            root = tree.getroot()
     except Exception as e:
         raise Exception(f"Failed to parse XML: {e}")
     
+    found = extract_fields(root)
+    text = lambda key: _element_text(found.get(key))
+    text_or_none = lambda key: _none_if_blank(text(key))
+
     filing_data = {}
     
-    ein = get_text(root, './/efile:Filer/efile:EIN')
+    ein = text('EIN')
     if not ein:
         return None
     filing_data['EIN'] = ein
     
-    filing_data['OrgName'] = get_text_or_none(root, './/efile:Filer/efile:BusinessName/efile:BusinessNameLine1Txt')
-    filing_data['State'] = get_text_or_none(root, './/efile:Filer/efile:USAddress/efile:StateAbbreviationCd')
-    filing_data['City'] = get_text_or_none(root, './/efile:Filer/efile:USAddress/efile:CityNm')
-    filing_data['TaxYear'] = parse_int(get_text(root, './/efile:TaxYr'))
-    filing_data['TaxPeriodEndDate'] = get_text_or_none(root, './/efile:TaxPeriodEndDt')
+    filing_data['OrgName'] = text_or_none('OrgName')
+    filing_data['State'] = text_or_none('State')
+    filing_data['City'] = text_or_none('City')
+    filing_data['TaxYear'] = parse_int(text('TaxYear'))
+    filing_data['TaxPeriodEndDate'] = text_or_none('TaxPeriodEndDate')
     
-    filing_data['NTEECode'] = get_text_or_none(root, './/efile:Filer/efile:NTEECd')
+    filing_data['NTEECode'] = text_or_none('NTEECode')
     
-    phones = root.xpath('.//efile:PhoneNum', namespaces=NS)
-    if phones:
-        filing_data['Phone'] = phones[0].text
+    if 'Phone' in found:
+        filing_data['Phone'] = found['Phone'].text
     
-    filing_data['PrincipalOfficer'] = get_text_or_none(root, './/efile:IRS990/efile:PrincipalOfficerNm')
+    filing_data['PrincipalOfficer'] = text_or_none('PrincipalOfficer')
     if not filing_data.get('PrincipalOfficer'):
-        filing_data['PrincipalOfficer'] = get_text_or_none(root, './/efile:Form990PartVIISectionAGrp/efile:PersonNm')
-    
-    irs990 = root.find('.//efile:IRS990', namespaces=NS)
-    if irs990 is not None:
-        filing_data['TotalAssetsEOY'] = parse_int(get_text(irs990, './/efile:TotalAssetsEOYAmt'))
-        filing_data['TotalLiabilitiesEOY'] = parse_int(get_text(irs990, './/efile:TotalLiabilitiesEOYAmt'))
-        filing_data['NetAssetsEOY'] = parse_int(get_text(irs990, './/efile:NetAssetsOrFundBalancesEOYAmt'))
-        filing_data['TotalRevenueCY'] = parse_int(get_text(irs990, './/efile:CYTotalRevenueAmt'))
-        filing_data['TotalRevenuePY'] = parse_int(get_text(irs990, './/efile:PYTotalRevenueAmt'))
-        filing_data['TotalExpensesCY'] = parse_int(get_text(irs990, './/efile:CYTotalExpensesAmt'))
-        filing_data['TotalExpensesPY'] = parse_int(get_text(irs990, './/efile:PYTotalExpensesAmt'))
-        filing_data['ContributionsCY'] = parse_int(get_text(irs990, './/efile:CYContributionsGrantsAmt'))
-        filing_data['ProgramServiceRevenueCY'] = parse_int(get_text(irs990, './/efile:CYProgramServiceRevenueAmt'))
-        filing_data['InvestmentIncomeCY'] = parse_int(get_text(irs990, './/efile:CYInvestmentIncomeAmt'))
-        filing_data['SalariesCY'] = parse_int(get_text(irs990, './/efile:CYSalariesCompEmpBnftPaidAmt'))
-        filing_data['FundraisingExpensesCY'] = parse_int(get_text(irs990, './/efile:CYTotalProfFndrsngExpnsAmt'))
-        filing_data['ProgramExpensesAmt'] = parse_int(get_text(irs990, './/efile:TotalProgramServiceExpensesAmt'))
+        filing_data['PrincipalOfficer'] = text_or_none('PartVIIPersonName')
+    
+    if 'IRS990' in found:
+        for field, key in IRS990_AMOUNT_FIELDS:
+            filing_data[field] = parse_int(text(key))
         
         other_revenue = 0
-        for tag in ['.//efile:CYOtherRevenueAmt', './/efile:CYTotalOtherIncAmt']:
-            val = parse_int(get_text(irs990, tag))
+        for key in ['CYOtherRevenueAmt', 'CYTotalOtherIncAmt']:
+            val = parse_int(text(key))
             if val:
                 other_revenue += val
         filing_data['OtherRevenueCY'] = other_revenue if other_revenue > 0 else None
         
-        filing_data['MissionDesc'] = (
-            get_text_or_none(irs990, './/efile:MissionDesc') or
-            get_text_or_none(irs990, './/efile:ActivityOrMissionDesc')
-        )
-        filing_data['WebsiteUrl'] = get_text_or_none(irs990, './/efile:WebsiteAddressTxt')
+        filing_data['MissionDesc'] = text_or_none('MissionDesc') or text_or_none('ActivityOrMissionDesc')
+        filing_data['WebsiteUrl'] = text_or_none('WebsiteUrl')
     
-    header = root.find('.//efile:ReturnHeader', namespaces=NS)
-    if header is not None:
+    if 'ReturnHeader' in found:
         if not filing_data.get('OrgName'):
-            filing_data['OrgName'] = get_text_or_none(header, './/efile:Filer/efile:BusinessName/efile:BusinessNameLine1Txt')
+            filing_data['OrgName'] = text_or_none('HeaderOrgName')
         if not filing_data.get('State'):
-            filing_data['State'] = get_text_or_none(header, './/efile:Filer/efile:USAddress/efile:StateAbbreviationCd')
+            filing_data['State'] = text_or_none('HeaderState')
         if not filing_data.get('City'):
-            filing_data['City'] = get_text_or_none(header, './/efile:Filer/efile:USAddress/efile:CityNm')
+            filing_data['City'] = text_or_none('HeaderCity')
     
     officers = []
-    irs990_part_vii = root.find('.//efile:Form990PartVIISectionAGrp', namespaces=NS)
+    irs990_part_vii = found.get('PartVII')
     if irs990_part_vii is not None:
-        for officer in irs990_part_vii:
+        for officer in irs990_part_vii.iterchildren(tag=etree.Element):
+            officer_found = extract_officer_fields(officer)
             officer_data = {
-                'OfficerName': get_text_or_none(officer, './/efile:PersonNm'),
-                'Title': get_text_or_none(officer, './/efile:TitleTxt'),
-                'AverageHoursPerWeek': parse_float(get_text(officer, './/efile:AverageHoursPerWeekRt')),
-                'ReportableCompFromOrg': parse_int(get_text(officer, './/efile:ReportableCompFromOrgAmt')),
-                'ReportableCompFromRelatedOrg': parse_int(get_text(officer, './/efile:ReportableCompFromRltdOrgAmt')),
-                'OtherCompensation': parse_int(get_text(officer, './/efile:OtherCompensationAmt')),
+                'OfficerName': _none_if_blank(_element_text(officer_found.get('OfficerName'))),
+                'Title': _none_if_blank(_element_text(officer_found.get('Title'))),
+                'AverageHoursPerWeek': parse_float(_element_text(officer_found.get('AverageHoursPerWeek'))),
+                'ReportableCompFromOrg': parse_int(_element_text(officer_found.get('ReportableCompFromOrg'))),
+                'ReportableCompFromRelatedOrg': parse_int(_element_text(officer_found.get('ReportableCompFromRelatedOrg'))),
+                'OtherCompensation': parse_int(_element_text(officer_found.get('OtherCompensation'))),
             }
             if officer_data['OfficerName']:
                 officers.append(officer_data)
@@ -135,13 +288,31 @@ def parse_xml_file(filepath):
     return filing_data
 
 
-def upsert_organization(conn, data):
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT OR REPLACE INTO organizations 
-        (EIN, LegalName, City, State, WebsiteUrl, MissionDescription, Phone, PrincipalOfficer, NTEECode)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+ORGANIZATION_SQL = """
+    INSERT OR REPLACE INTO organizations 
+    (EIN, LegalName, City, State, WebsiteUrl, MissionDescription, Phone, PrincipalOfficer, NTEECode)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+FILING_SQL = """
+    INSERT OR REPLACE INTO filings 
+    (EIN, TaxYear, TaxPeriodEndDate, TotalAssetsEOY, TotalLiabilitiesEOY, 
+     NetAssetsEOY, TotalRevenueCY, TotalRevenuePY, TotalExpensesCY, 
+     TotalExpensesPY, ContributionsCY, ProgramServiceRevenueCY, 
+     InvestmentIncomeCY, OtherRevenueCY, SalariesCY, FundraisingExpensesCY, 
+     ProgramExpensesAmt, SurplusDeficitCY, RawXMLPath)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+EXECUTIVE_COMPENSATION_SQL = """
+    INSERT INTO executive_compensation 
+    (EIN, TaxYear, OfficerName, Title, AverageHoursPerWeek, 
+     ReportableCompFromOrg, ReportableCompFromRelatedOrg, OtherCompensation)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def organization_row(data):
+    return (
         data['EIN'],
         data.get('OrgName'),
         data.get('City'),
@@ -151,24 +322,14 @@ def upsert_organization(conn, data):
         data.get('Phone'),
         data.get('PrincipalOfficer'),
         data.get('NTEECode')
-    ))
+    )
 
-def upsert_filing(conn, data):
-    cursor = conn.cursor()
-    
+def filing_row(data):
     surplus_deficit = None
     if data.get('TotalRevenueCY') and data.get('TotalExpensesCY'):
         surplus_deficit = data['TotalRevenueCY'] - data['TotalExpensesCY']
     
-    cursor.execute("""
-        INSERT OR REPLACE INTO filings 
-        (EIN, TaxYear, TaxPeriodEndDate, TotalAssetsEOY, TotalLiabilitiesEOY, 
-         NetAssetsEOY, TotalRevenueCY, TotalRevenuePY, TotalExpensesCY, 
-         TotalExpensesPY, ContributionsCY, ProgramServiceRevenueCY, 
-         InvestmentIncomeCY, OtherRevenueCY, SalariesCY, FundraisingExpensesCY, 
-         ProgramExpensesAmt, SurplusDeficitCY, RawXMLPath)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+    return (
         data['EIN'],
         data.get('TaxYear'),
         data.get('TaxPeriodEndDate'),
@@ -188,218 +349,380 @@ def upsert_filing(conn, data):
         data.get('ProgramExpensesAmt'),
         surplus_deficit,
         data.get('RawXMLPath')
-    ))
+    )
 
-def upsert_executive_compensation(conn, ein, tax_year, officers):
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM executive_compensation WHERE EIN = ? AND TaxYear = ?", (ein, tax_year))
-    
-    for officer in officers:
-        cursor.execute("""
-            INSERT INTO executive_compensation 
-            (EIN, TaxYear, OfficerName, Title, AverageHoursPerWeek, 
-             ReportableCompFromOrg, ReportableCompFromRelatedOrg, OtherCompensation)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            ein, tax_year,
-            officer.get('OfficerName'),
-            officer.get('Title'),
-            officer.get('AverageHoursPerWeek'),
-            officer.get('ReportableCompFromOrg'),
-            officer.get('ReportableCompFromRelatedOrg'),
-            officer.get('OtherCompensation')
-        ))
-
-def compute_derived_metrics(conn):
+def officer_rows(ein, tax_year, officers):
+    return [(
+        ein, tax_year,
+        officer.get('OfficerName'),
+        officer.get('Title'),
+        officer.get('AverageHoursPerWeek'),
+        officer.get('ReportableCompFromOrg'),
+        officer.get('ReportableCompFromRelatedOrg'),
+        officer.get('OtherCompensation')
+    ) for officer in officers]
+
+def record_rows(data):
+    """Compact, picklable form of a parsed filing: (organization, filing, officer rows)."""
+    officers = officer_rows(data['EIN'], data.get('TaxYear'), data['officers']) if data.get('officers') else []
+    return organization_row(data), filing_row(data), officers
+
+def load_rows(conn, rows):
+    org_row, fil_row, officers = rows
     cursor = conn.cursor()
+    cursor.execute(ORGANIZATION_SQL, org_row)
+    cursor.execute(FILING_SQL, fil_row)
+    if officers:
+        cursor.execute("DELETE FROM executive_compensation WHERE EIN = ? AND TaxYear = ?", officers[0][:2])
+        for row in officers:
+            cursor.execute(EXECUTIVE_COMPENSATION_SQL, row)
+
+class BulkLoader:
+    """
+    Buffers parsed records and writes them with executemany, one transaction per batch.
+
+    Within a batch the last record for an (EIN, TaxYear) wins, as it would when
+    loading one record at a time. If a batch hits a constraint error it is rolled
+    back and replayed record by record so only the offending files fail.
+
+    Records may carry their (path, size, mtime, sha1) source row, which is written
+    to parse_ledger in the same transaction as the data it produced. The
+    (EIN, TaxYear) of every record written is collected in dirty_keys.
+    """
+
+    def __init__(self, conn, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.records = []
+        self.sources = []
+        self.callbacks = []
+        self.dirty_keys = set()
+        self.success_count = 0
+        self.fail_log = []
+
+    def add(self, label, rows, source=None):
+        self.records.append((label, rows, source))
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def record_source(self, source, key=(None, None)):
+        """Queue a parse_ledger row for a source that produced no rows to load."""
+        self.sources.append((*source, *key))
+        if len(self.sources) >= self.batch_size:
+            self.flush()
+
+    def after_commit(self, callback):
+        """Run callback once everything added so far has been committed."""
+        self.callbacks.append(callback)
+
+    def flush(self):
+        if not self.records and not self.sources:
+            self._run_callbacks()
+            return
+        org_rows = [rows[0] for _, rows, _ in self.records]
+        fil_rows = [rows[1] for _, rows, _ in self.records]
+        officers_by_key = {}
+        for _, rows, _ in self.records:
+            if rows[2]:
+                officers_by_key[tuple(rows[2][0][:2])] = rows[2]
+        ledger_rows = self.sources + [
+            (*source, *rows[1][:2]) for _, rows, source in self.records if source]
+        self.dirty_keys.update(tuple(rows[1][:2]) for _, rows, _ in self.records)
+
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany(ORGANIZATION_SQL, org_rows)
+            cursor.executemany(FILING_SQL, fil_rows)
+            cursor.executemany(
+                "DELETE FROM executive_compensation WHERE EIN = ? AND TaxYear = ?", list(officers_by_key))
+            cursor.executemany(
+                EXECUTIVE_COMPENSATION_SQL, [row for rows in officers_by_key.values() for row in rows])
+            cursor.executemany(LEDGER_SQL, ledger_rows)
+            self.conn.commit()
+            self.success_count += len(self.records)
+        except sqlite3.Error:
+            self.conn.rollback()
+            ledger_rows = list(self.sources)
+            for label, rows, source in self.records:
+                try:
+                    load_rows(self.conn, rows)
+                    self.success_count += 1
+                    key = rows[1][:2]
+                except Exception as e:
+                    self.fail_log.append((label, str(e)))
+                    key = (None, None)
+                if source:
+                    ledger_rows.append((*source, *key))
+            self.conn.executemany(LEDGER_SQL, ledger_rows)
+            self.conn.commit()
+        self.records = []
+        self.sources = []
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+DERIVED_METRICS_SQL = """
+    INSERT OR REPLACE INTO derived_metrics 
+    (EIN, TaxYear, RevenueGrowthYoY, AssetGrowthYoY, ProgramExpenseRatio,
+     AdminExpenseRatio, FundraisingExpenseRatio, ExecCompPercentOfRevenue,
+     LiabilityToAssetRatio, ContributionDependencyPct, SurplusTrend, LeadScore)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Lead score weights; dashboard/scoring.py keeps the same defaults for what-if scoring
+LEAD_SCORE_WEIGHTS = {
+    'revenue_growth': 25,
+    'program_ratio': 30,
+    'surplus': 20,
+    'liability_ratio': 15,
+    'exec_comp': 10,
+}
+
+FILING_METRIC_COLUMNS = [
+    'TotalAssetsEOY', 'TotalLiabilitiesEOY', 'NetAssetsEOY', 'TotalRevenueCY',
+    'TotalRevenuePY', 'TotalExpensesCY', 'ProgramExpensesAmt', 'FundraisingExpensesCY',
+    'ContributionsCY', 'SurplusDeficitCY',
+]
+
+def _present(values):
+    # Missing and zero amounts are both treated as absent, as a truthiness test would
+    return values.notna() & (values != 0)
+
+def compute_derived_metrics(conn, keys=None):
+    """
+    Compute ratios, prior-year growth and the lead score as whole-column
+    operations and write them to derived_metrics in one batch.
+
+    With `keys`, only those (EIN, TaxYear) rows and the following year's rows
+    (whose growth and surplus trend depend on them) are recomputed; otherwise
+    every filing is.
+    """
+    ein_filter = ""
+    if keys is not None:
+        keys = set(keys)
+        if not keys:
+            return
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS dirty_eins (EIN TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.dirty_eins")
+        conn.executemany("INSERT OR IGNORE INTO temp.dirty_eins (EIN) VALUES (?)", [(ein,) for ein, _ in keys])
+        ein_filter = "AND EIN IN (SELECT EIN FROM temp.dirty_eins)"
+    
+    filings = pd.read_sql_query(
+        f"SELECT EIN, TaxYear, {', '.join(FILING_METRIC_COLUMNS)} FROM filings WHERE 1 = 1 {ein_filter}", conn)
+    if filings.empty:
+        return
+    filings['TaxYear'] = filings['TaxYear'].astype('Int64')
+    filings[FILING_METRIC_COLUMNS] = filings[FILING_METRIC_COLUMNS].astype('float64')
+    
+    exec_comp = pd.read_sql_query(f"""
+        SELECT EIN, TaxYear, SUM(ReportableCompFromOrg) AS ExecComp
+        FROM executive_compensation
+        WHERE TaxYear IS NOT NULL {ein_filter}
+        GROUP BY EIN, TaxYear
+    """, conn)
+    exec_comp['TaxYear'] = exec_comp['TaxYear'].astype('Int64')
+    exec_comp['ExecComp'] = exec_comp['ExecComp'].astype('float64')
+    
+    prior = filings.loc[filings['TaxYear'].notna(), ['EIN', 'TaxYear', 'TotalAssetsEOY', 'SurplusDeficitCY']]
+    prior = prior.assign(TaxYear=prior['TaxYear'] + 1).rename(columns={
+        'TotalAssetsEOY': 'PrevAssetsEOY', 'SurplusDeficitCY': 'PrevSurplusDeficitCY'})
+    
+    m = filings.merge(prior, on=['EIN', 'TaxYear'], how='left')
+    m = m.merge(exec_comp, on=['EIN', 'TaxYear'], how='left')
+    
+    assets, liabilities = m['TotalAssetsEOY'], m['TotalLiabilitiesEOY']
+    revenue, revenue_py = m['TotalRevenueCY'], m['TotalRevenuePY']
+    expenses, program = m['TotalExpensesCY'], m['ProgramExpensesAmt']
+    fundraising, contributions = m['FundraisingExpensesCY'], m['ContributionsCY']
+    surplus, prev_surplus = m['SurplusDeficitCY'], m['PrevSurplusDeficitCY']
+    prev_assets, exec_total = m['PrevAssetsEOY'], m['ExecComp']
+    
+    revenue_growth = ((revenue - revenue_py) / revenue_py).where(_present(revenue) & _present(revenue_py))
+    asset_growth = ((assets - prev_assets) / prev_assets).where(_present(assets) & _present(prev_assets))
+    program_ratio = (program / expenses).where(_present(program) & _present(expenses))
+    
+    admin_expenses = expenses - program - fundraising
+    admin_ratio = (admin_expenses / expenses).where(
+        _present(expenses) & _present(program) & _present(fundraising) & (admin_expenses > 0))
+    
+    fundraiser_ratio = (fundraising / expenses).where(_present(fundraising) & _present(expenses))
+    exec_comp_pct = (exec_total / revenue).where(_present(exec_total) & _present(revenue))
+    liability_asset_ratio = (liabilities / assets).where(_present(liabilities) & _present(assets))
+    contrib_dep_pct = (contributions / revenue).where(_present(contributions) & _present(revenue))
+    
+    surplus_trend = pd.Series(0.0, index=m.index)
+    surplus_trend[(surplus > 0) & (prev_surplus > 0)] = 1.0
+    surplus_trend[(surplus < 0) & (prev_surplus < 0)] = -1.0
+    surplus_trend = surplus_trend.where(_present(surplus) & prev_surplus.notna())
+    
+    lead_score = compute_lead_scores(
+        revenue_growth, program_ratio, surplus, liability_asset_ratio, exec_comp_pct)
+    
+    results = pd.DataFrame({
+        'EIN': m['EIN'], 'TaxYear': m['TaxYear'],
+        'RevenueGrowthYoY': revenue_growth, 'AssetGrowthYoY': asset_growth,
+        'ProgramExpenseRatio': program_ratio, 'AdminExpenseRatio': admin_ratio,
+        'FundraisingExpenseRatio': fundraiser_ratio, 'ExecCompPercentOfRevenue': exec_comp_pct,
+        'LiabilityToAssetRatio': liability_asset_ratio, 'ContributionDependencyPct': contrib_dep_pct,
+        'SurplusTrend': surplus_trend, 'LeadScore': lead_score,
+    })
+    if keys is not None:
+        targets = keys | {(ein, year + 1) for ein, year in keys if year is not None}
+        in_targets = [(ein, None if pd.isna(year) else year) in targets
+                      for ein, year in zip(results['EIN'], results['TaxYear'])]
+        results = results[in_targets]
+    
+    # NULL years never conflict on UNIQUE(EIN, TaxYear), so clear them rather than pile up copies
+    conn.execute(f"DELETE FROM derived_metrics WHERE TaxYear IS NULL {ein_filter}")
+    results = results.astype(object)
+    results = results.where(results.notna(), None)
+    conn.executemany(DERIVED_METRICS_SQL, results.itertuples(index=False, name=None))
+
+def compute_lead_scores(revenue_growth, program_ratio, surplus_deficit, liability_ratio, exec_comp_pct,
+                        weights=LEAD_SCORE_WEIGHTS):
+    """
+    Lead score (0-100) per row from aligned metric Series; missing inputs drop out
+    of the weighted average and rows with none of them get NaN.
+    """
+    score = pd.Series(0.0, index=revenue_growth.index)
+    weight_sum = pd.Series(0, index=revenue_growth.index)
     
-    cursor.execute("""
-        SELECT 
-            f.EIN,
-            f.TaxYear,
-            f.TotalAssetsEOY,
-            f.TotalLiabilitiesEOY,
-            f.NetAssetsEOY,
-            f.TotalRevenueCY,
-            f.TotalRevenuePY,
-            f.TotalExpensesCY,
-            f.ProgramExpensesAmt,
-            f.FundraisingExpensesCY,
-            f.ContributionsCY,
-            f.SurplusDeficitCY
-        FROM filings f
-    """)
-    
-    filings = cursor.fetchall()
-    
-    metrics_by_ein_year = {}
-    
-    for row in filings:
-        ein = row[0]
-        tax_year = row[1]
-        key = (ein, tax_year)
-        metrics_by_ein_year[key] = {
-            'TotalAssetsEOY': row[2],
-            'TotalLiabilitiesEOY': row[3],
-            'NetAssetsEOY': row[4],
-            'TotalRevenueCY': row[5],
-            'TotalRevenuePY': row[6],
-            'TotalExpensesCY': row[7],
-            'ProgramExpensesAmt': row[8],
-            'FundraisingExpensesCY': row[9],
-            'ContributionsCY': row[10],
-            'SurplusDeficitCY': row[11]
-        }
-    
-    for (ein, tax_year), m in metrics_by_ein_year.items():
-        prev_key = (ein, tax_year - 1)
-        prev_m = metrics_by_ein_year.get(prev_key)
-        
-        revenue_growth = None
-        if m['TotalRevenueCY'] and m['TotalRevenuePY'] and m['TotalRevenuePY'] != 0:
-            revenue_growth = (m['TotalRevenueCY'] - m['TotalRevenuePY']) / m['TotalRevenuePY']
-        
-        asset_growth = None
-        if m['TotalAssetsEOY'] and prev_m and prev_m['TotalAssetsEOY'] and prev_m['TotalAssetsEOY'] != 0:
-            asset_growth = (m['TotalAssetsEOY'] - prev_m['TotalAssetsEOY']) / prev_m['TotalAssetsEOY']
-        
-        program_ratio = None
-        if m['ProgramExpensesAmt'] and m['TotalExpensesCY'] and m['TotalExpensesCY'] != 0:
-            program_ratio = m['ProgramExpensesAmt'] / m['TotalExpensesCY']
-        
-        admin_ratio = None
-        admin_expenses = None
-        if m['TotalExpensesCY'] and m['ProgramExpensesAmt'] and m['FundraisingExpensesCY']:
-            admin_expenses = m['TotalExpensesCY'] - m['ProgramExpensesAmt'] - m['FundraisingExpensesCY']
-            if admin_expenses > 0:
-                admin_ratio = admin_expenses / m['TotalExpensesCY']
-        
-        fundraiser_ratio = None
-        if m['FundraisingExpensesCY'] and m['TotalExpensesCY'] and m['TotalExpensesCY'] != 0:
-            fundraiser_ratio = m['FundraisingExpensesCY'] / m['TotalExpensesCY']
-        
-        cursor.execute("""
-            SELECT SUM(ReportableCompFromOrg) 
-            FROM executive_compensation 
-            WHERE EIN = ? AND TaxYear = ?
-        """, (ein, tax_year))
-        exec_comp = cursor.fetchone()[0] or 0
-        
-        exec_comp_pct = None
-        if exec_comp and m['TotalRevenueCY'] and m['TotalRevenueCY'] != 0:
-            exec_comp_pct = exec_comp / m['TotalRevenueCY']
-        
-        liability_asset_ratio = None
-        if m['TotalLiabilitiesEOY'] and m['TotalAssetsEOY'] and m['TotalAssetsEOY'] != 0:
-            liability_asset_ratio = m['TotalLiabilitiesEOY'] / m['TotalAssetsEOY']
-        
-        contrib_dep_pct = None
-        if m['ContributionsCY'] and m['TotalRevenueCY'] and m['TotalRevenueCY'] != 0:
-            contrib_dep_pct = m['ContributionsCY'] / m['TotalRevenueCY']
-        
-        surplus_trend = None
-        if m['SurplusDeficitCY'] and prev_m and prev_m.get('SurplusDeficitCY') is not None:
-            if m['SurplusDeficitCY'] > 0 and prev_m['SurplusDeficitCY'] > 0:
-                surplus_trend = 1
-            elif m['SurplusDeficitCY'] < 0 and prev_m['SurplusDeficitCY'] < 0:
-                surplus_trend = -1
-            else:
-                surplus_trend = 0
-        
-        lead_score = compute_lead_score(
-            revenue_growth, program_ratio, m['SurplusDeficitCY'],
-            liability_asset_ratio, exec_comp_pct
-        )
-        
-        cursor.execute("""
-            INSERT OR REPLACE INTO derived_metrics 
-            (EIN, TaxYear, RevenueGrowthYoY, AssetGrowthYoY, ProgramExpenseRatio,
-             AdminExpenseRatio, FundraisingExpenseRatio, ExecCompPercentOfRevenue,
-             LiabilityToAssetRatio, ContributionDependencyPct, SurplusTrend, LeadScore)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            ein, tax_year, revenue_growth, asset_growth, program_ratio,
-            admin_ratio, fundraiser_ratio, exec_comp_pct, liability_asset_ratio,
-            contrib_dep_pct, surplus_trend, lead_score
-        ))
-
-def compute_lead_score(revenue_growth, program_ratio, surplus_deficit, liability_ratio, exec_comp_pct):
-    score = 0
-    weight_sum = 0
-    
-    if revenue_growth is not None:
-        score += revenue_growth * 25
-        weight_sum += 25
-    
-    if program_ratio is not None:
-        score += program_ratio * 30
-        weight_sum += 30
-    
-    if surplus_deficit is not None:
-        if surplus_deficit > 0:
-            score += 20
-        weight_sum += 20
-    
-    if liability_ratio is not None:
-        score -= liability_ratio * 15
-        weight_sum += 15
-    
-    if exec_comp_pct is not None:
-        score -= exec_comp_pct * 10
-        weight_sum += 10
-    
-    if weight_sum == 0:
-        return None
+    score = score + (revenue_growth * weights['revenue_growth']).fillna(0.0)
+    weight_sum = weight_sum + revenue_growth.notna() * weights['revenue_growth']
     
-    normalized_score = (score / weight_sum) * 100
+    score = score + (program_ratio * weights['program_ratio']).fillna(0.0)
+    weight_sum = weight_sum + program_ratio.notna() * weights['program_ratio']
     
-    return max(0, min(100, normalized_score))
-
-def process_xml_files():
-    files = [f for f in os.listdir(XML_DIR) if f.endswith('.xml')]
-    print(f"Found {len(files)} XML files to process")
+    score = score + (surplus_deficit > 0) * float(weights['surplus'])
+    weight_sum = weight_sum + surplus_deficit.notna() * weights['surplus']
     
-    conn = get_connection()
+    score = score - (liability_ratio * weights['liability_ratio']).fillna(0.0)
+    weight_sum = weight_sum + liability_ratio.notna() * weights['liability_ratio']
     
-    success_count = 0
-    fail_count = 0
-    fail_log = []
+    score = score - (exec_comp_pct * weights['exec_comp']).fillna(0.0)
+    weight_sum = weight_sum + exec_comp_pct.notna() * weights['exec_comp']
     
-    for i, filename in enumerate(files):
-        filepath = os.path.join(XML_DIR, filename)
-        
+    normalized_score = (score / weight_sum) * 100
+    return normalized_score.clip(upper=100).clip(lower=0).where(weight_sum != 0)
+
+class StreamingLoader:
+    """
+    Parses XML documents handed over by the downloader and loads them into SQLite.
+
+    submit() puts raw bytes on a bounded queue, so the downloader blocks rather
+    than buffering without limit when parsing falls behind. Parse threads feed a
+    single writer thread that owns the SQLite connection and commits in batches.
+
+    A document's on_committed callback runs on the writer thread once its rows
+    (or its failure) are committed. If the writer fails, it keeps draining its
+    queue so that nothing upstream blocks, and submit() and close() re-raise
+    the error.
+    """
+
+    def __init__(self, parse_workers=2, queue_size=64, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.parse_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.success_count = 0
+        self.fail_count = 0
+        self.fail_log = []
+        self.error = None
+        self.write_closed = False
+        self.started = time.monotonic()
+        self.parsers = [threading.Thread(target=self._parse_loop, daemon=True) for _ in range(parse_workers)]
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        for thread in self.parsers:
+            thread.start()
+        self.writer.start()
+
+    def _raise_if_failed(self):
+        if self.error is not None:
+            raise RuntimeError(f"SQLite writer failed: {self.error}") from self.error
+
+    def submit(self, label, content, raw_xml_path=None, on_committed=None):
+        self._raise_if_failed()
+        self.parse_queue.put((label, content, raw_xml_path, on_committed))
+
+    def _parse_loop(self):
+        while True:
+            item = self.parse_queue.get()
+            if item is None:
+                break
+            label, content, raw_xml_path, on_committed = item
+            source = None
+            try:
+                source = source_row(raw_xml_path, content) if raw_xml_path else None
+                data = parse_xml_file(raw_xml_path, content=content)
+                self.write_queue.put((label, data, None if data else "No data parsed", source, on_committed))
+            except Exception as e:
+                self.write_queue.put((label, None, str(e), source, on_committed))
+
+    def _next_write(self):
+        item = self.write_queue.get()
+        if item is None:
+            self.write_closed = True
+        return item
+
+    def _write_loop(self):
         try:
-            data = parse_xml_file(filepath)
-            if data:
-                upsert_organization(conn, data)
-                upsert_filing(conn, data)
-                if data.get('officers'):
-                    upsert_executive_compensation(
-                        conn, data['EIN'], data.get('TaxYear'), data['officers']
-                    )
-                success_count += 1
-                
-                if (i + 1) % 50 == 0:
-                    print(f"Processed {i + 1}/{len(files)} files")
-            else:
-                fail_count += 1
-                fail_log.append((filename, "No data parsed"))
-        except Exception as e:
-            fail_count += 1
-            fail_log.append((filename, str(e)))
-    
-    conn.commit()
-    print("Computing derived metrics...")
-    compute_derived_metrics(conn)
-    conn.commit()
-    conn.close()
-    
+            self._write()
+        except BaseException as e:
+            self.error = e
+            # Keep consuming so parse threads, and through them submit(), never block on a dead writer
+            while not self.write_closed:
+                self._next_write()
+
+    def _write(self):
+        conn = get_connection()
+        apply_schema(conn)
+        with bulk_load_profile(conn):
+            loader = BulkLoader(conn, self.batch_size)
+            while True:
+                item = self._next_write()
+                if item is None:
+                    break
+                label, data, error, source, on_committed = item
+                if error:
+                    self.fail_log.append((label, error))
+                    if source:
+                        loader.record_source(source)
+                else:
+                    loader.add(label, record_rows(data), source)
+                if on_committed:
+                    loader.after_commit(on_committed)
+            loader.flush()
+            self.fail_log.extend(loader.fail_log)
+            self.success_count = loader.success_count
+            self.fail_count = len(self.fail_log)
+            print(f"Computing derived metrics for {len(loader.dirty_keys)} filings...")
+            compute_derived_metrics(conn, loader.dirty_keys)
+            refresh_org_latest_summary(conn, {ein for ein, _ in loader.dirty_keys})
+            conn.commit()
+        conn.close()
+
+    def close(self):
+        for _ in self.parsers:
+            self.parse_queue.put(None)
+        for thread in self.parsers:
+            thread.join()
+        self.write_queue.put(None)
+        self.writer.join()
+        self._raise_if_failed()
+
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        print_parse_summary(self.success_count, self.fail_count, self.fail_log)
+        print(f"  Parsed {(self.success_count + self.fail_count) / elapsed:.1f} files/s while downloading")
+
+def print_parse_summary(success_count, fail_count, fail_log):
     print("=" * 50)
     print(f"PARSE SUMMARY:")
     print(f"  Records inserted: {success_count}")
     print(f"  Records failed: {fail_count}")
     print("=" * 50)
-    
+
     if fail_log:
         print("\nFailed files:")
         for fn, err in fail_log[:10]:
@@ -407,5 +730,140 @@ def process_xml_files():
         if len(fail_log) > 10:
             print(f"  ... and {len(fail_log) - 10} more")
 
+def _reset_pack_reader():
+    # A forked worker must not reuse the parent's SQLite handle or memory maps
+    global _pack_reader
+    _pack_reader = None
+
+def parse_chunk(sources):
+    """
+    Parse a chunk of (path, size, mtime, sha1) sources in a worker process.
+    Returns (path, rows, error, source) per source, with the content hash filled in.
+    """
+    results = []
+    for source in sources:
+        filepath = source[0]
+        try:
+            if is_pack_ref(filepath):
+                content = get_pack_reader().read_ref(filepath)
+            else:
+                with open(filepath, 'rb') as f:
+                    content = f.read()
+            source = source[:3] + (content_hash(content),)
+            data = parse_xml_file(filepath, content=content)
+            results.append((filepath, record_rows(data) if data else None, None if data else "No data parsed", source))
+        except Exception as e:
+            results.append((filepath, None, str(e), source))
+    return results
+
+def iter_parsed(sources, jobs, chunk_size=PARSE_CHUNK_SIZE):
+    """Yield (path, rows, error, source) in source order, parsing serially or across `jobs` processes."""
+    if jobs <= 1:
+        for source in sources:
+            yield from parse_chunk([source])
+        return
+
+    chunks = [sources[i:i + chunk_size] for i in range(0, len(sources), chunk_size)]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_reset_pack_reader) as pool:
+        for results in pool.map(parse_chunk, chunks):
+            yield from results
+
+def load_sources(conn, loader, sources, ledger, jobs, fail_log, forced=frozenset()):
+    """
+    Parse `sources` and hand their rows to `loader`. Sources whose content hash
+    matches the ledger (touched but not modified) only have their ledger row
+    refreshed, unless they are in `forced`. Returns (unchanged count, keys whose
+    rows were removed because their source now yields a different filing).
+    """
+    unchanged = 0
+    lost_keys = set()
+    started = time.monotonic()
+    for i, (filepath, rows, error, source) in enumerate(iter_parsed(sources, jobs)):
+        filename = os.path.basename(filepath)
+        entry = ledger.get(filepath)
+        
+        if entry and filepath not in forced and source[3] is not None and source[3] == entry[2]:
+            loader.record_source(source, entry[3:5])
+            unchanged += 1
+            continue
+        
+        new_key = tuple(rows[1][:2]) if rows else None
+        if entry_key(entry) is not None and entry_key(entry) != new_key:
+            lost_keys |= remove_sources(conn, [filepath])
+        
+        if error:
+            fail_log.append((filename, error))
+            if source[3] is not None:
+                loader.record_source(source)
+        else:
+            loader.add(filename, rows, source)
+        
+        if (i + 1) % 500 == 0:
+            rate = (i + 1) / max(time.monotonic() - started, 1e-6)
+            print(f"Processed {i + 1}/{len(sources)} files ({rate:.0f} files/s)")
+    loader.flush()
+    return unchanged, lost_keys
+
+def process_xml_files(jobs=1, batch_size=BATCH_SIZE, full=False):
+    sources = scan_sources()
+    
+    conn = get_connection()
+    apply_schema(conn)
+    if full:
+        conn.execute("DELETE FROM parse_ledger")
+        conn.commit()
+    ledger = load_ledger(conn)
+    to_parse, removed = plan_sources(sources, ledger)
+    print(f"Found {len(sources)} XML files: {len(to_parse)} new or changed, "
+          f"{len(sources) - len(to_parse)} unchanged, {len(removed)} removed")
+    
+    fail_log = []
+    started = time.monotonic()
+    
+    with bulk_load_profile(conn):
+        # Another source may hold a filing for a key whose rows were just dropped
+        lost_keys = remove_sources(conn, removed) if removed else set()
+        parsed = {source[0] for source in to_parse}
+        requeued = sources_for_keys(sources, ledger, lost_keys, exclude=parsed)
+        dirty_keys = set(lost_keys)
+        
+        loader = BulkLoader(conn, batch_size)
+        unchanged, lost_keys = load_sources(
+            conn, loader, to_parse + requeued, ledger, jobs, fail_log,
+            forced={source[0] for source in requeued})
+        dirty_keys |= lost_keys
+        parsed.update(source[0] for source in requeued)
+        requeued = sources_for_keys(sources, ledger, lost_keys, exclude=parsed)
+        if requeued:
+            load_sources(conn, loader, requeued, ledger, jobs, fail_log,
+                         forced={source[0] for source in requeued})
+        fail_log.extend(loader.fail_log)
+        dirty_keys |= loader.dirty_keys
+        
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"Parsed and loaded {len(to_parse)} files in {elapsed:.1f}s ({len(to_parse) / elapsed:.0f} files/s)")
+        if unchanged:
+            print(f"  {unchanged} files had a new mtime but unchanged content")
+        if full:
+            print("Computing derived metrics...")
+            compute_derived_metrics(conn)
+            refresh_org_latest_summary(conn)
+        else:
+            print(f"Computing derived metrics for {len(dirty_keys)} changed filings...")
+            compute_derived_metrics(conn, dirty_keys)
+            refresh_org_latest_summary(conn, {ein for ein, _ in dirty_keys})
+        conn.commit()
+    conn.close()
+    
+    print_parse_summary(loader.success_count, len(fail_log), fail_log)
+
 if __name__ == "__main__":
-    process_xml_files()
+    parser = argparse.ArgumentParser(description='Parse 990 XML filings and load them into SQLite')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Parse files across N worker processes (SQLite is still written by one process)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='Records written per executemany batch / transaction')
+    parser.add_argument('--full', action='store_true',
+                        help='Ignore the parse ledger, re-parse every XML source and recompute all derived metrics')
+    args = parser.parse_args()
+    process_xml_files(jobs=args.jobs, batch_size=args.batch_size, full=args.full)
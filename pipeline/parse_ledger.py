@@ -0,0 +1,89 @@
+"""
+Record of which raw XML sources have already been parsed into the database.
+
+Every source (a file in data/raw_xml or a pack reference) is stored in the
+parse_ledger table with the size, mtime and content hash it had when it was
+loaded, plus the (EIN, TaxYear) it produced. process_xml_files uses this to
+parse only new or changed sources and to drop rows whose source is gone.
+"""
+
+import hashlib
+
+LEDGER_SQL = """
+    INSERT OR REPLACE INTO parse_ledger (SourcePath, Size, MTime, ContentHash, EIN, TaxYear)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# Keeps the IN (...) lists below SQLite's bound-parameter limit.
+DELETE_CHUNK = 500
+
+
+def content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def load_ledger(conn):
+    """{SourcePath: (Size, MTime, ContentHash, EIN, TaxYear)} for every recorded source."""
+    rows = conn.execute("SELECT SourcePath, Size, MTime, ContentHash, EIN, TaxYear FROM parse_ledger")
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def entry_key(entry):
+    """(EIN, TaxYear) a ledger entry produced, or None if it produced no filing."""
+    if entry is None or entry[3] is None:
+        return None
+    return tuple(entry[3:5])
+
+
+def is_unchanged(entry, size, mtime, sha1):
+    if entry is None:
+        return False
+    # Pack sources carry their hash in the pack index; files are judged by size and mtime
+    if sha1 is not None:
+        return sha1 == entry[2]
+    return size == entry[0] and mtime == entry[1]
+
+
+def plan_sources(sources, ledger):
+    """Return (sources that need parsing, ledger paths whose source no longer exists)."""
+    current = set()
+    to_parse = []
+    for source in sources:
+        path, size, mtime, sha1 = source
+        current.add(path)
+        if not is_unchanged(ledger.get(path), size, mtime, sha1):
+            to_parse.append(source)
+    removed = [path for path in ledger if path not in current]
+    return to_parse, removed
+
+
+def sources_for_keys(sources, ledger, keys, exclude=()):
+    """Sources whose last parse produced one of `keys`, other than those in `exclude`."""
+    return [source for source in sources
+            if source[0] not in exclude and entry_key(ledger.get(source[0])) in keys]
+
+
+def remove_sources(conn, paths):
+    """
+    Delete the filings loaded from `paths` along with their officers, derived
+    metrics and ledger rows, and any organization left without a filing.
+    Returns the (EIN, TaxYear) keys that lost their filing.
+    """
+    paths = list(paths)
+    keys = set()
+    for i in range(0, len(paths), DELETE_CHUNK):
+        chunk = paths[i:i + DELETE_CHUNK]
+        marks = ','.join('?' * len(chunk))
+        keys.update(tuple(row) for row in conn.execute(
+            f"SELECT EIN, TaxYear FROM filings WHERE RawXMLPath IN ({marks})", chunk))
+        conn.execute(f"DELETE FROM filings WHERE RawXMLPath IN ({marks})", chunk)
+        conn.execute(f"DELETE FROM parse_ledger WHERE SourcePath IN ({marks})", chunk)
+
+    conn.executemany("DELETE FROM executive_compensation WHERE EIN = ? AND TaxYear = ?", list(keys))
+    conn.executemany("DELETE FROM derived_metrics WHERE EIN = ? AND TaxYear = ?", list(keys))
+    conn.executemany("""
+        DELETE FROM organizations
+        WHERE EIN = ? AND NOT EXISTS (SELECT 1 FROM filings WHERE filings.EIN = organizations.EIN)
+    """, [(ein,) for ein in {key[0] for key in keys}])
+    conn.commit()
+    return keys
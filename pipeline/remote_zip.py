@@ -0,0 +1,223 @@
+"""
+Read individual members out of a remote ZIP archive using HTTP Range requests.
+
+The central directory sits at the end of a ZIP file, so we fetch the tail of
+the archive, work out where each wanted member's local header starts, and then
+request only those byte ranges (merging ranges that sit close together).
+"""
+
+import re
+import struct
+import threading
+import zlib
+from collections import namedtuple
+
+EOCD_SIG = b'PK\x05\x06'
+ZIP64_LOCATOR_SIG = b'PK\x06\x07'
+ZIP64_EOCD_SIG = b'PK\x06\x06'
+CENTRAL_HEADER_SIG = b'PK\x01\x02'
+LOCAL_HEADER_SIG = b'PK\x03\x04'
+
+EOCD_SIZE = 22
+ZIP64_LOCATOR_SIZE = 20
+CENTRAL_HEADER_SIZE = 46
+LOCAL_HEADER_SIZE = 30
+MAX_COMMENT_SIZE = 65535
+
+# Enough to hold the end-of-central-directory record plus the largest
+# possible archive comment and the ZIP64 locator in front of it.
+TAIL_SIZE = EOCD_SIZE + MAX_COMMENT_SIZE + ZIP64_LOCATOR_SIZE
+
+# Ranges whose gap is smaller than this are fetched in a single request,
+# as long as the merged span stays under MAX_SPAN_SIZE (it is held in memory).
+MERGE_GAP = 64 * 1024
+MAX_SPAN_SIZE = 16 * 1024 * 1024
+
+ZipMember = namedtuple('ZipMember', ['filename', 'method', 'compressed_size', 'header_offset', 'end_offset'])
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class NotModified(Exception):
+    pass
+
+
+class ByteBudget:
+    """Caps the number of bytes held in memory across concurrent downloads."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        with self.cond:
+            # A single request larger than the limit is let through on its own
+            while self.in_flight and self.in_flight + n > self.limit:
+                self.cond.wait()
+            self.in_flight += n
+
+    def release(self, n):
+        with self.cond:
+            self.in_flight -= n
+            self.cond.notify_all()
+
+
+def fetch_range(session, url, start, end, stats, timeout=300, headers=None):
+    """Fetch bytes [start, end] (inclusive) of url; end=None means a suffix range of `start` bytes."""
+    byte_range = f"bytes=-{start}" if end is None else f"bytes={start}-{end}"
+    response = session.get(url, headers={**(headers or {}), 'Range': byte_range}, stream=True, timeout=timeout)
+    try:
+        if response.status_code == 404:
+            response.raise_for_status()
+        if response.status_code == 304:
+            raise NotModified(url)
+        if response.status_code != 206:
+            raise RangeNotSupported(f"server answered {response.status_code} to a Range request")
+        data = response.content
+    finally:
+        response.close()
+
+    stats['bytes_fetched'] = stats.get('bytes_fetched', 0) + len(data)
+    stats['requests'] = stats.get('requests', 0) + 1
+    stats['headers'] = response.headers
+
+    match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', response.headers.get('Content-Range', ''))
+    if not match:
+        raise RangeNotSupported("missing or malformed Content-Range header")
+    total = int(match.group(3)) if match.group(3) != '*' else None
+    return int(match.group(1)), data, total
+
+
+def _parse_zip64_extra(extra, compressed_size, uncompressed_size, header_offset):
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, size = struct.unpack('<HH', extra[pos:pos + 4])
+        if tag == 0x0001:
+            field = extra[pos + 4:pos + 4 + size]
+            values = []
+            for i in range(0, len(field) - 7, 8):
+                values.append(struct.unpack('<Q', field[i:i + 8])[0])
+            if uncompressed_size == 0xFFFFFFFF and values:
+                uncompressed_size = values.pop(0)
+            if compressed_size == 0xFFFFFFFF and values:
+                compressed_size = values.pop(0)
+            if header_offset == 0xFFFFFFFF and values:
+                header_offset = values.pop(0)
+            break
+        pos += 4 + size
+    return compressed_size, uncompressed_size, header_offset
+
+
+def _locate_central_directory(tail, tail_start, session, url, stats):
+    eocd_pos = tail.rfind(EOCD_SIG)
+    if eocd_pos < 0 or eocd_pos + EOCD_SIZE > len(tail):
+        raise ValueError("end of central directory record not found")
+
+    (_, _, _, _, entry_count, cd_size, cd_offset, _) = struct.unpack(
+        '<4sHHHHIIH', tail[eocd_pos:eocd_pos + EOCD_SIZE])
+
+    locator_pos = eocd_pos - ZIP64_LOCATOR_SIZE
+    if locator_pos >= 0 and tail[locator_pos:locator_pos + 4] == ZIP64_LOCATOR_SIG:
+        _, _, zip64_eocd_offset, _ = struct.unpack('<4sIQI', tail[locator_pos:locator_pos + ZIP64_LOCATOR_SIZE])
+        if zip64_eocd_offset >= tail_start:
+            record = tail[zip64_eocd_offset - tail_start:zip64_eocd_offset - tail_start + 56]
+        else:
+            _, record, _ = fetch_range(session, url, zip64_eocd_offset, zip64_eocd_offset + 55, stats)
+        if record[:4] != ZIP64_EOCD_SIG:
+            raise ValueError("ZIP64 end of central directory record not found")
+        _, entry_count, cd_size, cd_offset = struct.unpack('<QQQQ', record[24:56])
+
+    return entry_count, cd_size, cd_offset
+
+
+def read_central_directory(session, url, stats, headers=None):
+    """Return (members, archive_size) for the ZIP at url, reading only its tail."""
+    tail_start, tail, total = fetch_range(session, url, TAIL_SIZE, None, stats, headers=headers)
+    if total is None:
+        total = tail_start + len(tail)
+
+    entry_count, cd_size, cd_offset = _locate_central_directory(tail, tail_start, session, url, stats)
+
+    if cd_offset >= tail_start:
+        directory = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+    else:
+        _, directory, _ = fetch_range(session, url, cd_offset, cd_offset + cd_size - 1, stats)
+
+    entries = []
+    pos = 0
+    for _ in range(entry_count):
+        if directory[pos:pos + 4] != CENTRAL_HEADER_SIG:
+            raise ValueError(f"bad central directory entry at offset {cd_offset + pos}")
+        fields = struct.unpack('<4s6H3I5H2I', directory[pos:pos + CENTRAL_HEADER_SIZE])
+        method = fields[4]
+        compressed_size, uncompressed_size = fields[8], fields[9]
+        name_len, extra_len, comment_len = fields[10], fields[11], fields[12]
+        header_offset = fields[16]
+
+        name_start = pos + CENTRAL_HEADER_SIZE
+        filename = directory[name_start:name_start + name_len].decode('utf-8', errors='replace')
+        extra = directory[name_start + name_len:name_start + name_len + extra_len]
+        compressed_size, _, header_offset = _parse_zip64_extra(
+            extra, compressed_size, uncompressed_size, header_offset)
+
+        entries.append((filename, method, compressed_size, header_offset))
+        pos = name_start + name_len + extra_len + comment_len
+
+    # A member's bytes run up to the next local header (or the central directory),
+    # which covers the variable-length local extra field and any data descriptor.
+    offsets = sorted({e[3] for e in entries} | {cd_offset})
+    next_offset = {offsets[i]: offsets[i + 1] for i in range(len(offsets) - 1)}
+
+    members = [
+        ZipMember(filename, method, compressed_size, header_offset, next_offset.get(header_offset, cd_offset))
+        for filename, method, compressed_size, header_offset in entries
+    ]
+    return members, total
+
+
+def plan_ranges(members, merge_gap=MERGE_GAP, max_span_size=MAX_SPAN_SIZE):
+    """Group members into (start, end_exclusive, [members]) spans, merging spans closer than merge_gap."""
+    spans = []
+    for member in sorted(members, key=lambda m: m.header_offset):
+        if (spans and member.header_offset - spans[-1][1] <= merge_gap
+                and member.end_offset - spans[-1][0] <= max_span_size):
+            start, end, group = spans[-1]
+            group.append(member)
+            spans[-1] = (start, max(end, member.end_offset), group)
+        else:
+            spans.append((member.header_offset, member.end_offset, [member]))
+    return spans
+
+
+def extract_member(blob, blob_start, member):
+    """Decompress `member` out of `blob`, a chunk of the archive beginning at offset blob_start."""
+    pos = member.header_offset - blob_start
+    header = blob[pos:pos + LOCAL_HEADER_SIZE]
+    if header[:4] != LOCAL_HEADER_SIG:
+        raise ValueError(f"bad local header for {member.filename}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    data_start = pos + LOCAL_HEADER_SIZE + name_len + extra_len
+    data = blob[data_start:data_start + member.compressed_size]
+
+    if member.method == 0:
+        return data
+    if member.method == 8:
+        return zlib.decompress(data, -15)
+    raise ValueError(f"unsupported compression method {member.method} for {member.filename}")
+
+
+def iter_remote_members(session, url, members, stats, merge_gap=MERGE_GAP, budget=None):
+    """Yield (member, bytes) for each of `members`, fetching only the ranges that hold them."""
+    for start, end, group in plan_ranges(members, merge_gap):
+        if budget:
+            budget.acquire(end - start)
+        try:
+            blob_start, blob, _ = fetch_range(session, url, start, end - 1, stats)
+            for member in group:
+                yield member, extract_member(blob, blob_start, member)
+        finally:
+            if budget:
+                budget.release(end - start)
@@ -5,6 +5,7 @@ DB_PATH = "database/nonprofit_intelligence.db"
 TARGET_EINS_FILE = "data/target_eins.csv"
 MATCHED_INDEX_FILE = "data/matched_filing_index.csv"
 XML_DIR = "data/raw_xml"
+PACK_INDEX = "data/raw_xml_pack/index.db"
 
 def count_csv_lines(filepath):
     if not os.path.exists(filepath):
@@ -17,6 +18,17 @@ def count_xml_files():
         return 0
     return len([f for f in os.listdir(XML_DIR) if f.endswith('.xml')])
 
+def count_packed_filings():
+    if not os.path.exists(PACK_INDEX):
+        return 0
+    conn = sqlite3.connect(PACK_INDEX)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
 def count_db_records():
     if not os.path.exists(DB_PATH):
         return {t: 0 for t in ['organizations', 'filings', 'executive_compensation', 'derived_metrics', 'prospect_activity']}
@@ -45,12 +57,14 @@ def main():
     ein_count = count_csv_lines(TARGET_EINS_FILE)
     index_count = count_csv_lines(MATCHED_INDEX_FILE)
     xml_count = count_xml_files()
+    packed_count = count_packed_filings()
     db_counts = count_db_records()
     
     print(f"\nData Files:")
     print(f"  target_eins.csv:           {ein_count:>6} EINs")
     print(f"  matched_filing_index.csv:  {index_count:>6} rows")
     print(f"  raw_xml/ directory:        {xml_count:>6} XML files")
+    print(f"  raw_xml_pack/ store:       {packed_count:>6} packed filings")
     
     print(f"\nDatabase Records:")
     print(f"  organizations:            {db_counts.get('organizations', 0):>6} records")
@@ -75,7 +89,7 @@ def main():
     else:
         health.append("✗ No matched filings - run download_index_and_match_urls.py")
     
-    if xml_count > 0:
+    if xml_count > 0 or packed_count > 0:
         health.append("✓ XML files downloaded")
     else:
         health.append("✗ No XML files - run download_xml_filings.py")
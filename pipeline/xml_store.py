@@ -0,0 +1,161 @@
+"""
+Compressed pack-file store for raw 990 XML filings.
+
+Filings are zlib-compressed and appended to large pack files instead of being
+written one file per filing. A small SQLite index maps each OBJECT_ID (and its
+EIN / TAX_PERIOD) to the pack, offset and length of its blob, so lookups are a
+single primary-key read and a slice of a memory-mapped pack.
+
+Filings stored here are referred to as "xmlpack:<OBJECT_ID>" wherever a file
+path would otherwise be used (e.g. filings.RawXMLPath).
+"""
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import zlib
+
+PACK_DIR = 'data/raw_xml_pack'
+INDEX_FILE = 'index.db'
+PACK_REF_PREFIX = 'xmlpack:'
+
+# Start a new pack file once the current one grows past this size.
+MAX_PACK_SIZE = 1024 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+COMMIT_EVERY = 200
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    ObjectId TEXT PRIMARY KEY,
+    EIN TEXT NOT NULL,
+    TaxPeriod TEXT,
+    PackFile TEXT NOT NULL,
+    Offset INTEGER NOT NULL,
+    Length INTEGER NOT NULL,
+    RawSize INTEGER NOT NULL,
+    Sha1 TEXT NOT NULL
+);
+"""
+
+
+def pack_ref(object_id):
+    return f"{PACK_REF_PREFIX}{object_id}"
+
+
+def is_pack_ref(path):
+    return path is not None and path.startswith(PACK_REF_PREFIX)
+
+
+def open_index(pack_dir=PACK_DIR):
+    os.makedirs(pack_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(pack_dir, INDEX_FILE), check_same_thread=False)
+    conn.executescript(INDEX_SCHEMA)
+    return conn
+
+
+class XMLPackWriter:
+    """Appends filings to pack files. Safe to share between threads."""
+
+    def __init__(self, pack_dir=PACK_DIR):
+        self.pack_dir = pack_dir
+        self.lock = threading.Lock()
+        self.index = open_index(pack_dir)
+        self.pending = 0
+        self.pack_name, self.pack = self._open_pack()
+
+    def _open_pack(self):
+        existing = sorted(f for f in os.listdir(self.pack_dir) if f.endswith('.pack'))
+        if existing and os.path.getsize(os.path.join(self.pack_dir, existing[-1])) < MAX_PACK_SIZE:
+            name = existing[-1]
+        else:
+            name = f"pack-{len(existing):05d}.pack"
+        return name, open(os.path.join(self.pack_dir, name), 'ab')
+
+    def contains(self, object_id):
+        with self.lock:
+            row = self.index.execute("SELECT 1 FROM blobs WHERE ObjectId = ?", (object_id,)).fetchone()
+            return row is not None
+
+    def put(self, object_id, ein, tax_period, content):
+        """Store one filing; returns its pack reference."""
+        blob = zlib.compress(content, COMPRESSION_LEVEL)
+        sha1 = hashlib.sha1(content).hexdigest()
+        with self.lock:
+            if self.pack.tell() >= MAX_PACK_SIZE:
+                self._commit()
+                self.pack.close()
+                self.pack_name, self.pack = self._open_pack()
+            offset = self.pack.tell()
+            self.pack.write(blob)
+            self.index.execute("""
+                INSERT OR REPLACE INTO blobs (ObjectId, EIN, TaxPeriod, PackFile, Offset, Length, RawSize, Sha1)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (object_id, ein, tax_period, self.pack_name, offset, len(blob), len(content), sha1))
+            self.pending += 1
+            if self.pending >= COMMIT_EVERY:
+                self._commit()
+        return pack_ref(object_id)
+
+    def commit(self):
+        """Make every filing put so far durable: pack bytes synced, index rows committed."""
+        with self.lock:
+            self._commit()
+
+    def _commit(self):
+        # Pack bytes must hit the disk before the index rows that point at them
+        self.pack.flush()
+        os.fsync(self.pack.fileno())
+        self.index.commit()
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.pack.close()
+            self.index.close()
+
+
+class XMLPackReader:
+    """Random-access reads from pack files through memory maps."""
+
+    def __init__(self, pack_dir=PACK_DIR):
+        self.pack_dir = pack_dir
+        self.index = open_index(pack_dir)
+        self.maps = {}
+
+    def _map(self, pack_file, needed_end):
+        mapped = self.maps.get(pack_file)
+        # Packs still being appended to may have grown since they were mapped
+        if mapped is None or len(mapped) < needed_end:
+            if mapped is not None:
+                mapped.close()
+            with open(os.path.join(self.pack_dir, pack_file), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[pack_file] = mapped
+        return mapped
+
+    def get(self, object_id):
+        row = self.index.execute(
+            "SELECT PackFile, Offset, Length FROM blobs WHERE ObjectId = ?", (object_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(object_id)
+        pack_file, offset, length = row
+        mapped = self._map(pack_file, offset + length)
+        return zlib.decompress(mapped[offset:offset + length])
+
+    def read_ref(self, ref):
+        return self.get(ref[len(PACK_REF_PREFIX):])
+
+    def ref_stats(self):
+        """(reference, uncompressed size, sha1) for every stored filing."""
+        return [(pack_ref(row[0]), row[1], row[2]) for row in self.index.execute(
+            "SELECT ObjectId, RawSize, Sha1 FROM blobs ORDER BY ObjectId")]
+
+    def close(self):
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps = {}
+        self.index.close()
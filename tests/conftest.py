@@ -0,0 +1,72 @@
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Pipeline and dashboard modules import their siblings directly, and database.* from the repo root
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'pipeline'), os.path.join(ROOT, 'dashboard')]
+
+
+class ArchiveServer:
+    """Serves in-memory files over HTTP, honouring Range requests unless told not to."""
+
+    def __init__(self):
+        self.files = {}
+        self.honour_range = True
+        self.ranges = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, send_body):
+                data = server.files.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                byte_range = self.headers.get('Range')
+                server.ranges.append(byte_range)
+                match = re.fullmatch(r'bytes=(\d*)-(\d*)', byte_range or '')
+                if server.honour_range and match:
+                    first, last = match.groups()
+                    if first:
+                        start, end = int(first), min(int(last or len(data) - 1), len(data) - 1)
+                    else:
+                        start, end = max(len(data) - int(last), 0), len(data) - 1
+                    body = data[start:end + 1]
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+                else:
+                    body = data
+                    self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', f'"{len(data)}"')
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_port}{path}'
+
+
+@pytest.fixture
+def archive_server():
+    server = ArchiveServer()
+    server.thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
@@ -0,0 +1,49 @@
+import pytest
+
+from export_to_supabase import CopyStream
+
+ROWS = [
+    ('123456789', 'Tab\there', 'Line one\nline two', 'Carriage\rreturn', 'C:\\path\\to', None),
+    ('987654321', 'Both \\t and\t\\N', '', None, 42, 1.5),
+    ('555555555', 'Café – ünïcode', 'trailing\\', '\\N', 0, None),
+]
+
+EXPECTED = (
+    '123456789\tTab\\there\tLine one\\nline two\tCarriage\\rreturn\tC:\\\\path\\\\to\t\\N\n'
+    '987654321\tBoth \\\\t and\\t\\\\N\t\t\\N\t42\t1.5\n'
+    '555555555\tCafé – ünïcode\ttrailing\\\\\t\\\\N\t0\t\\N\n'
+).encode('utf-8')
+
+
+def read_all(stream, size):
+    chunks = []
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return b''.join(chunks)
+        assert size < 0 or len(chunk) <= size
+        chunks.append(chunk)
+
+
+def test_escapes_copy_text():
+    stream = CopyStream(ROWS)
+
+    assert stream.read() == EXPECTED
+    assert stream.rows == len(ROWS)
+
+
+@pytest.mark.parametrize('fetch_rows', [1, 2, 100])
+@pytest.mark.parametrize('size', [1, 7, 64, -1])
+def test_read_sizes_and_batches_give_the_same_text(fetch_rows, size):
+    # A generator, like a SQLite cursor, can only be consumed once
+    stream = CopyStream((row for row in ROWS), fetch_rows=fetch_rows)
+
+    assert read_all(stream, size) == EXPECTED
+    assert stream.rows == len(ROWS)
+
+
+def test_empty_source():
+    stream = CopyStream([])
+
+    assert stream.read(1024) == b''
+    assert stream.rows == 0
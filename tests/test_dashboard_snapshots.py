@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import pytest
+
+import data
+import snapshots
+
+
+class FakeQuery:
+    """Just enough of a postgrest query builder: filters and ordering are ignored."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.record = None
+
+    def select(self, columns, count=None, head=False):
+        return self
+
+    def upsert(self, record, **kwargs):
+        self.record = record
+        return self
+
+    def __getattr__(self, name):
+        # order, range, in_, eq, gte, ...
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        if self.record is not None:
+            self.rows[:] = [row for row in self.rows if row['ein'] != self.record['ein']] + [self.record]
+        return SimpleNamespace(data=list(self.rows), count=len(self.rows))
+
+
+class FakeClient:
+    def __init__(self, **tables):
+        self.tables = tables
+
+    def table(self, name):
+        return FakeQuery(self.tables.setdefault(name, []))
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    client = FakeClient(org_latest_summary=[
+        {'ein': '123456789', 'legalname': 'Example Org', 'state': 'FL', 'totalassetseoy': 1000000,
+         'leadscore': 55.0, 'contactstatus': None, 'iswatchlisted': 0, 'updatedat': '2026-01-01 00:00:00'},
+    ])
+    monkeypatch.setattr(snapshots, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(data, 'get_client', lambda: client)
+    data.shared_snapshot_frame.clear()
+    yield client
+    data.shared_snapshot_frame.clear()
+
+
+def summary_status(ein):
+    row = data.load_summary_data(('FL',)).set_index('ein').loc[ein]
+    return row['contactstatus'], row['iswatchlisted']
+
+
+def test_save_shows_up_in_an_empty_prospect_snapshot(client):
+    # A fresh deployment: no prospect rows remotely yet
+    data.refresh_snapshot('prospect_activity')
+    assert snapshots.read_snapshot('prospect_activity').column_names == [
+        'ein', 'contactstatus', 'iswatchlisted', 'updatedat']
+    assert data.load_summary_data(('FL',))['contactstatus'].isna().all()
+
+    data.save_prospect_activity('123456789', 'Contacted', True, 'Spoke to the ED')
+
+    assert [row['contactstatus'] for row in client.tables['prospect_activity']] == ['Contacted']
+    assert summary_status('123456789') == ('Contacted', 1)
+
+
+def test_save_replaces_the_row_in_a_populated_snapshot(client):
+    client.tables['prospect_activity'] = [
+        {'ein': '123456789', 'contactstatus': 'New', 'iswatchlisted': 0, 'updatedat': '2026-01-01 00:00:00'},
+        {'ein': '987654321', 'contactstatus': 'Qualified', 'iswatchlisted': 1, 'updatedat': '2026-01-01 00:00:00'},
+    ]
+    data.refresh_snapshot('prospect_activity')
+
+    data.save_prospect_activity('123456789', 'Contacted', False, '')
+
+    df = data.load_snapshot('prospect_activity').set_index('ein')
+    assert df['contactstatus'].to_dict() == {'123456789': 'Contacted', '987654321': 'Qualified'}
+
+
+def test_save_before_any_snapshot_is_fetched_on_the_next_load(client):
+    data.save_prospect_activity('123456789', 'Contacted', True, '')
+
+    assert snapshots.read_snapshot('prospect_activity') is None
+    assert summary_status('123456789') == ('Contacted', 1)
@@ -0,0 +1,135 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import parse_and_load
+from database import db_setup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Compared between an incremental run and a --full rebuild, without the surrogate
+# *Id keys and *At load timestamps, which differ from one load to the next
+TABLES = ['organizations', 'filings', 'executive_compensation', 'derived_metrics',
+          'org_latest_summary', 'parse_ledger']
+
+
+def make_return(ein, year, revenue, assets=2_000_000, officers=('Pat Doe',)):
+    people = ''.join(
+        f'<OfficerEntry><PersonNm>{name}</PersonNm><TitleTxt>Director</TitleTxt>'
+        f'<ReportableCompFromOrgAmt>{50000 + i}</ReportableCompFromOrgAmt></OfficerEntry>'
+        for i, name in enumerate(officers))
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<Return xmlns="http://www.irs.gov/efile">
+  <ReturnHeader>
+    <TaxPeriodEndDt>{year}-12-31</TaxPeriodEndDt>
+    <Filer>
+      <EIN>{ein}</EIN>
+      <BusinessName><BusinessNameLine1Txt>Org {ein}</BusinessNameLine1Txt></BusinessName>
+      <USAddress><CityNm>Tampa</CityNm><StateAbbreviationCd>FL</StateAbbreviationCd></USAddress>
+    </Filer>
+    <TaxYr>{year}</TaxYr>
+  </ReturnHeader>
+  <ReturnData>
+    <IRS990>
+      <CYTotalRevenueAmt>{revenue}</CYTotalRevenueAmt>
+      <PYTotalRevenueAmt>{revenue - 1000}</PYTotalRevenueAmt>
+      <CYTotalExpensesAmt>{revenue - 5000}</CYTotalExpensesAmt>
+      <TotalAssetsEOYAmt>{assets}</TotalAssetsEOYAmt>
+      <TotalLiabilitiesEOYAmt>{assets // 4}</TotalLiabilitiesEOYAmt>
+      <TotalProgramServiceExpensesAmt>{revenue // 2}</TotalProgramServiceExpensesAmt>
+      <Form990PartVIISectionAGrp>{people}</Form990PartVIISectionAGrp>
+    </IRS990>
+  </ReturnData>
+</Return>
+""".encode()
+
+
+def write_source(name, content, mtime):
+    path = os.path.join(parse_and_load.XML_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def dump_database():
+    conn = sqlite3.connect(db_setup.DB_PATH)
+    try:
+        tables = {}
+        for table in TABLES:
+            cursor = conn.execute(f"SELECT * FROM {table}")
+            columns = [column[0] for column in cursor.description]
+            rows = [{name: value for name, value in zip(columns, row) if not name.endswith(('Id', 'At'))}
+                    for row in cursor]
+            tables[table] = sorted(rows, key=lambda row: repr(sorted(row.items())))
+        return tables
+    finally:
+        conn.close()
+
+
+def run(full=False):
+    parse_and_load.process_xml_files(full=full)
+    return dump_database()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # The pipeline works on paths relative to the repo root; run it inside tmp_path instead
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db_setup, 'SCHEMA_PATH', os.path.join(ROOT, 'database', 'schema.sql'))
+    os.makedirs(parse_and_load.XML_DIR)
+    return tmp_path
+
+
+def test_incremental_run_matches_full_rebuild(workdir, capsys):
+    write_source('a2020.xml', make_return('590000001', 2020, 1_000_000, assets=1_500_000), 1000)
+    write_source('a2021.xml', make_return('590000001', 2021, 1_100_000, assets=1_800_000), 1000)
+    write_source('a2022.xml', make_return('590000001', 2022, 1_200_000, assets=2_100_000), 1000)
+    write_source('b.xml', make_return('590000002', 2022, 900_000, officers=('Ann Lee', 'Bo Chan')), 1000)
+    write_source('c.xml', make_return('590000003', 2022, 700_000), 1000)
+    write_source('d.xml', make_return('590000004', 2021, 600_000), 1000)
+    # Two sources for the same (EIN, TaxYear): whichever loads last holds the filing
+    write_source('shadow1.xml', make_return('590000005', 2022, 500_000), 1000)
+    write_source('shadow2.xml', make_return('590000005', 2022, 550_000), 1000)
+    run()
+
+    conn = sqlite3.connect(db_setup.DB_PATH)
+    (holder,) = conn.execute("SELECT RawXMLPath FROM filings WHERE EIN = '590000005'").fetchone()
+    conn.close()
+    capsys.readouterr()
+
+    # Deleted: a year other filings' growth depends on, and the shadow holding its key
+    os.remove(os.path.join(parse_and_load.XML_DIR, 'a2021.xml'))
+    os.remove(holder)
+    # Changed in place, and changed to a different (EIN, TaxYear)
+    write_source('b.xml', make_return('590000002', 2022, 950_000, officers=('Ann Lee',)), 2000)
+    write_source('c.xml', make_return('590000003', 2023, 700_000), 2000)
+    # Touched but identical
+    write_source('d.xml', make_return('590000004', 2021, 600_000), 2000)
+    # New
+    write_source('e.xml', make_return('590000006', 2022, 800_000), 2000)
+    incremental = run()
+
+    out = capsys.readouterr().out
+    assert "Found 7 XML files: 4 new or changed, 3 unchanged, 2 removed" in out
+    assert "1 files had a new mtime but unchanged content" in out
+    filings = {(row['EIN'], row['TaxYear']): row for row in incremental['filings']}
+    # The surviving shadow was loaded again in place of the deleted one
+    assert filings[('590000005', 2022)]['RawXMLPath'] not in (None, holder)
+    assert ('590000003', 2022) not in filings and ('590000003', 2023) in filings
+    assert ('590000001', 2021) not in filings
+    assert ('590000001', 2021) not in {(row['EIN'], row['TaxYear']) for row in incremental['derived_metrics']}
+    assert [row['OfficerName'] for row in incremental['executive_compensation'] if row['EIN'] == '590000002'] == [
+        'Ann Lee']
+
+    shutil.move('database', 'database_incremental')
+    assert incremental == run(full=True)
+
+    # Nothing changed since, so another incremental run is a no-op
+    shutil.rmtree('database')
+    shutil.move('database_incremental', 'database')
+    capsys.readouterr()
+    assert run() == incremental
+    assert "0 new or changed" in capsys.readouterr().out
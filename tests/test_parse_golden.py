@@ -0,0 +1,37 @@
+import glob
+import json
+import os
+
+import pytest
+
+from parse_and_load import parse_xml_file
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+# Each <name>.xml sits next to <name>.json, the dict parse_xml_file returned for
+# it (null if rejected) before the single-walk extractor replaced the per-field
+# XPath lookups. The walk must give exactly the same result.
+GOLDEN_FILES = sorted(glob.glob(os.path.join(GOLDEN_DIR, '*.xml')))
+
+
+def expected_for(path, raw_xml_path):
+    with open(path[:-len('.xml')] + '.json') as f:
+        expected = json.load(f)
+    if expected is not None:
+        expected['RawXMLPath'] = raw_xml_path
+    return expected
+
+
+@pytest.mark.parametrize('path', GOLDEN_FILES, ids=os.path.basename)
+def test_parse_matches_golden_output(path):
+    label = os.path.basename(path)
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    assert parse_xml_file(label, content=content) == expected_for(path, label)
+    assert parse_xml_file(path) == expected_for(path, path)
+
+
+def test_golden_corpus_covers_accepted_and_rejected_returns():
+    outcomes = [expected_for(path, path) is not None for path in GOLDEN_FILES]
+    assert any(outcomes) and not all(outcomes)
@@ -0,0 +1,134 @@
+import io
+import os
+import struct
+import zipfile
+
+import pytest
+import requests
+
+import download_xml_filings
+from download_ledger import DownloadLedger
+from download_xml_filings import DownloadState, FileStore, process_archive
+from remote_zip import (EOCD_SIG, MAX_COMMENT_SIZE, MERGE_GAP, TAIL_SIZE, ZIP64_EOCD_SIG, RangeNotSupported,
+                        fetch_range, iter_remote_members, read_central_directory)
+
+
+def make_zip(members, zip64=False, comment=b''):
+    """Build an archive from {name: (bytes, compress_type)}; zip64 forces ZIP64 records at tiny sizes."""
+    buffer = io.BytesIO()
+    with pytest.MonkeyPatch.context() as mp:
+        if zip64:
+            # zipfile switches to ZIP64 records past these limits, so a small archive gets them too
+            mp.setattr(zipfile, 'ZIP64_LIMIT', 64)
+            mp.setattr(zipfile, 'ZIP_FILECOUNT_LIMIT', 1)
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.comment = comment
+            for name, (data, compress_type) in members.items():
+                zf.writestr(name, data, compress_type=compress_type)
+    archive = buffer.getvalue()
+    if zip64:
+        # zipfile still fills in the classic end record; saturate it as a >4 GB archive
+        # would, so the entry count, size and offset can only come from the ZIP64 record
+        eocd = archive.rfind(EOCD_SIG)
+        archive = (archive[:eocd + 8] + struct.pack('<HHII', 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF)
+                   + archive[eocd + 20:])
+    return archive
+
+
+def filing(object_id):
+    return f'<Return><EIN>{object_id}</EIN>{"<Filler/>" * 50}</Return>'.encode()
+
+
+def sample_members(count, padding=0):
+    members = {}
+    for i in range(count):
+        members[f'2024_TEOS_XML_01A/2024{i:08d}_public.xml'] = (
+            filing(i), zipfile.ZIP_DEFLATED if i % 2 else zipfile.ZIP_STORED)
+        if padding:
+            # Incompressible filler between filings, too far apart to be merged into one range
+            members[f'2024_TEOS_XML_01A/padding{i}.bin'] = (os.urandom(padding), zipfile.ZIP_STORED)
+    return members
+
+
+def read_remote(url, wanted=None):
+    session = requests.Session()
+    stats = {}
+    members, total = read_central_directory(session, url, stats)
+    if wanted is not None:
+        members = [m for m in members if m.filename in wanted]
+    contents = {member.filename: data for member, data in iter_remote_members(session, url, members, stats)}
+    return members, total, contents, stats
+
+
+# A maximal comment fills the fetched tail, leaving the directory and ZIP64 end record before it
+COMMENTS = pytest.mark.parametrize('comment', [b'', b'x' * MAX_COMMENT_SIZE],
+                                   ids=['directory-in-tail', 'directory-before-tail'])
+
+
+@COMMENTS
+def test_reads_members_over_ranges(archive_server, comment):
+    members = sample_members(6, padding=MERGE_GAP + 1000)
+    archive = make_zip(members, comment=comment)
+    archive_server.files['/a.zip'] = archive
+
+    wanted = {name for name in members if name.endswith('_public.xml')}
+    listed, total, contents, stats = read_remote(archive_server.url('/a.zip'), wanted)
+
+    assert total == len(archive)
+    assert {m.filename for m in listed} == wanted
+    assert contents == {name: members[name][0] for name in wanted}
+    assert all(r and r.startswith('bytes=') for r in archive_server.ranges)
+    # The tail, the directory when it lies outside it, and one range per filing
+    assert stats['requests'] == (2 if comment else 1) + 6
+    assert stats['bytes_fetched'] < TAIL_SIZE + 10000
+
+
+@COMMENTS
+def test_reads_zip64_central_directory(archive_server, comment):
+    members = sample_members(5)
+    archive = make_zip(members, zip64=True, comment=comment)
+    # ZIP64 end records, and 0x0001 extra fields holding the sizes and offsets
+    assert ZIP64_EOCD_SIG in archive
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert all(info.extra[:2] == b'\x01\x00' for info in zf.infolist())
+    archive_server.files['/zip64.zip'] = archive
+
+    listed, total, contents, _ = read_remote(archive_server.url('/zip64.zip'))
+
+    assert total == len(archive)
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert [(m.filename, m.compressed_size, m.header_offset) for m in listed] == [
+            (info.filename, info.compress_size, info.header_offset) for info in zf.infolist()]
+    assert contents == {name: data for name, (data, _) in members.items()}
+
+
+def test_fetch_range_rejects_full_response(archive_server):
+    archive_server.files['/a.zip'] = make_zip(sample_members(2))
+    archive_server.honour_range = False
+
+    with pytest.raises(RangeNotSupported):
+        fetch_range(requests.Session(), archive_server.url('/a.zip'), 100, None, {})
+
+
+def test_falls_back_to_full_download_without_range(archive_server, tmp_path, monkeypatch):
+    members = sample_members(4)
+    archive_server.files['/2024_TEOS_XML_01A.zip'] = make_zip(members)
+    archive_server.honour_range = False
+    monkeypatch.setattr(download_xml_filings, 'OUTPUT_DIR', str(tmp_path / 'raw_xml'))
+    os.makedirs(tmp_path / 'raw_xml')
+
+    object_id_to_ein = {f'2024{i:08d}': f'10000000{i}' for i in (1, 2)}
+    store = FileStore(object_id_to_ein, {ein: '202412' for ein in object_id_to_ein.values()})
+    ledger = DownloadLedger(path=str(tmp_path / 'ledger.json'), before_flush=store.commit)
+    state = DownloadState(16, ledger, store)
+    zip_url = archive_server.url('/2024_TEOS_XML_01A.zip')
+
+    process_archive(requests.Session(), zip_url, None, {}, object_id_to_ein, state,
+                    use_ranges=True, max_memory_mb=1)
+
+    assert state.counts['extracted'] == 2
+    for i in (1, 2):
+        with open(tmp_path / 'raw_xml' / f'10000000{i}_202412.xml', 'rb') as f:
+            assert f.read() == filing(i)
+    entry = ledger.entry(zip_url)
+    assert entry['complete'] and sorted(entry['yielded']) == sorted(object_id_to_ein)